@@ -1,9 +1,22 @@
 import boto3
-import csv
-import io
 import re
 import os
 import pandas as pd
+# cost_accounting first, it hooks the boto3 session before the other modules create their clients
+import cost_accounting
+import log_partitions
+import listing_columns
+import log_cache
+import log_source
+import pending_queue
+import prefix_trie
+import profiling
+import report_writer
+import run_context
+import s3_lister
+import sal_parser
+import seen_set
+import sla_engine
 from botocore.exceptions import ClientError
 from datetime import datetime, timezone, timedelta
  
@@ -19,35 +32,31 @@ sns_client = boto3.client('sns')
 # Server Access Logs related variables
 # log_bucket = 'aws-cloudtrail-logs-122036648197-3b304768-nfl-s3-monitor'
 # log_prefix = "s3/nfl/"
-log_bucket = 'aws-logs-useast01'
+# sal_log_partitions format = account01:region01:log_bucket01,account02:region02:log_bucket02....
+sal_partitions = log_partitions.parse_log_partitions(os.getenv('SAL_LOG_PARTITIONS', '211125347349:us-east-1:aws-logs-useast01'))
 log_prefix = "Awslogs/s3/"
  
-# bucket_names format = bucket01:prefix01,bucket02:prefix....
-bucket_names = os.getenv('BUCKET_NAMES').split(',')
-lambda_time_ran = datetime.utcnow().strftime('%Y-%m-%d_%H:%M:%S')
+# BUCKET_NAMES = bucket01:prefix01,bucket02:prefix.... or the NFL sheet in MONITORED_PREFIXES_FILE
+monitored_prefixes = prefix_trie.load_monitored_prefixes(os.getenv('BUCKET_NAMES'))
+prefix_tries = prefix_trie.build_prefix_tries(monitored_prefixes)
 
 # Bucket to store csv output
 output_bucket = os.getenv('OUTPUT_BUCKET', 'rtlab-petclinic-logstore-s3')
-output_csv_key = f'csv/nfl/log/{lambda_time_ran}_file_metadata.csv'
+# reports are written under dt=YYYY-MM-DD/hour=HH/bucket=... partitions, see report_writer
+report_prefix = os.getenv('REPORT_PREFIX', 'csv/nfl/log/')
 sns_topic_arn = os.getenv('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:211125347349:lambda-py')
 
 max_time_interval = 50
-current_time_utc = datetime.utcnow().replace(tzinfo=timezone.utc)
 
-file_metadatas = []
-csv_data = [["Bucket_name", "Prefix", "Filename", "Uploader", "Datetime_file_landed", "Datetime_lambda_ran", "Error_if_any"]]
+user_arn_pattern = re.compile(r'(arn:aws:iam::\d+:user/[^\s]+)')
+csv_header = ["Bucket_name", "Prefix", "Filename", "Uploader", "Datetime_file_landed", "Datetime_lambda_ran", "Error_if_any"]
  
-def write_csv_to_s3():
-    try:
-        csv_buffer = io.StringIO()
-        writer = csv.writer(csv_buffer)
-        writer.writerows(csv_data)
- 
-        s3_client.put_object(Bucket=output_bucket, Key=output_csv_key, Body=csv_buffer.getvalue())
-        print(f"CSV file uploaded to {output_bucket}/{output_csv_key}")
- 
-    except ClientError as e:
-        print(f"Error uploading CSV to S3: {e}")
+def write_csv_to_s3(run):
+    report_writer.write_report(
+        output_bucket, report_prefix, run['lambda_time_ran'], run['csv_data'][0], run['csv_data'][1:],
+        [nfl_bucket_name for nfl_bucket_name, _ in monitored_prefixes],
+        metadata=cost_accounting.summary_metadata(), fallback_time=run['current_time_utc']
+    )
  
 def send_notification(body):
     try:
@@ -61,85 +70,127 @@ def send_notification(body):
     except ClientError as e:
         print(f"Error sending metadata notification: {e}")
 
-def list_all_objects(log_bucket, log_prefix):
+def list_all_objects(log_bucket, log_prefix, current_time_utc):
     # list to append logs/objects
     log_objects = []
-    continuation_token = None
 
     try:
-        # while loop which will iterate based continuation_token
-        while True:
-            if continuation_token:
-                response = s3_client.list_objects_v2(
-                    Bucket=log_bucket,
-                    Prefix=log_prefix,
-                    ContinuationToken=continuation_token
-                )
-            else:
-                response = s3_client.list_objects_v2(
-                    Bucket=log_bucket,
-                    Prefix=log_prefix
-                )
-    
-            for obj in response.get('Contents', []):
-                log_key = obj['Key']
-                log_last_modified = obj['LastModified'] 
-    
-                # Check if the log file was modified within the expected time interval
-                if current_time_utc - log_last_modified > timedelta(hours=30):
-                    continue
-    
-                log_objects.append(log_key)
-    
-            # outside of for loop
-            if response.get('IsTruncated'):
-                continuation_token = response['NextContinuationToken']
-            else:
-                break
-    
+        # sub-prefixes of the log prefix are discovered and listed concurrently,
+        # local log folders used for offline replay are listed from disk
+        if log_source.is_local_source(log_bucket):
+            listing = log_source.list_logs(log_bucket, log_prefix)
+        else:
+            listing = s3_lister.walk_prefix(log_bucket, log_prefix, client=s3_client)
+
+        for obj in listing:
+            log_last_modified = obj['LastModified'] 
+
+            # Check if the log file was modified within the expected time interval
+            if current_time_utc - log_last_modified > timedelta(hours=30):
+                continue
+
+            log_objects.append(obj)
+
         return log_objects
     
     except ClientError as e:
         print(e)
  
-def fetch_uploader(nfl_file_key, nfl_bucket_name, log_objects):
+def load_upload_index(log_bucket, log_objects, nfl_bucket_names):
     try:
         if not log_objects:
             print(f"No logs found in the bucket {log_bucket}/{log_prefix}.")
-            return None
- 
-        put_pattern = re.compile(r'REST.PUT.OBJECT')
- 
-        # Iterate through each log and filter based on the LastModified time to scan only latest logs
+            return {}
+
+        # Upload columns of log objects parsed by an earlier invocation of this container come from log_cache,
+        # the other log objects are downloaded once, parsed and filtered to their PUT records
+        log_columns = []
+        parsed_records = 0
         for log_object in log_objects:
+            upload_columns = log_cache.get(log_bucket, log_object['Key'], log_object.get('ETag'))
+            if upload_columns is None:
+                parsed_columns = sal_parser.parse_sal_logs([log_source.read_log(log_bucket, log_object['Key'], log_object.get('ETag'))])
+                parsed_records += sal_parser.column_length(parsed_columns)
+                upload_columns = sal_parser.upload_columns(sal_parser.filter_uploads(parsed_columns, None))
+                log_cache.put(log_bucket, log_object['Key'], log_object.get('ETag'), upload_columns, sal_parser.columns_size(upload_columns))
+            log_columns.append(upload_columns)
+
+        # Keep only PUT records of the NFL buckets routed to this log bucket (vectorized), then the ones under their monitored prefixes
+        put_columns = sal_parser.filter_uploads(sal_parser.concat_columns(log_columns), nfl_bucket_names, operation=None)
+        put_columns = sal_parser.take_rows(put_columns, [
+            prefix_trie.is_monitored(prefix_tries, bucket, key) for bucket, key in zip(put_columns["bucket"], put_columns["key"])
+        ])
+        print(f"Parsed {parsed_records} log records, {sal_parser.column_length(put_columns)} PUT records for NFL buckets")
+
+        return sal_parser.build_uploader_index(put_columns)
+
+    except ClientError as e:
+        print(e)
+        return {}
  
-            log_data = s3_client.get_object(Bucket=log_bucket, Key=log_object)['Body'].read()
-            log_str = log_data.decode('utf-8')
+def build_upload_index(nfl_bucket_names, current_time_utc):
+    # Route every NFL bucket to the (account, region) partitions holding its access logs
+    # and scan the routed log buckets in parallel
+    routes = log_partitions.route_buckets(sal_partitions, nfl_bucket_names)
+
+    def scan_partition(partition, routed_buckets):
+        log_bucket = partition[2]
+        log_objects = list_all_objects(log_bucket, log_prefix, current_time_utc)
+        return load_upload_index(log_bucket, log_objects, routed_buckets)
+
+    upload_index = {}
+    for partition, partition_index in log_partitions.scan_partitions(routes, scan_partition):
+        upload_index.update(partition_index)
+    return upload_index
  
-            # Check for specific bucket name and object key
-            if put_pattern.search(log_str) and nfl_bucket_name in log_str and nfl_file_key in log_str:       
-            # if put_pattern.search(log_str):
-                match = re.search(r'(arn:aws:iam::\d+:user/[^\s]+)', log_str)
-                if match:
-                    username_arn = match.group(1)
-                    print(f"Found PUT object: {username_arn}")
-                    return username_arn.split('/')[-1]
-                else:
-                    print("Found Put object, but arn not available")
+def fetch_uploader(nfl_file_key, nfl_bucket_name, upload_index):
+    requester = upload_index.get((nfl_bucket_name, nfl_file_key))
+    if requester is None:
+        return None
+
+    # Only IAM user ARNs carry a readable uploader name
+    match = user_arn_pattern.match(requester)
+    if match:
+        username_arn = match.group(1)
+        print(f"Found PUT object: {username_arn}")
+        return username_arn.split('/')[-1]
+
+    print("Found Put object, but arn not available")
+    return None
  
-    except ClientError as e:
-        print(e)
+def recheck_pending(run, upload_index):
+    # Every log delivered since an earlier run is already parsed into this run's index, so files
+    # reported as "Logs not uploaded yet" are only looked up in it and their reports are patched
+    resolved = []
+    for entry in pending_queue.pending_uploads():
+        uploader_name = fetch_uploader(entry['key'], entry['bucket'], upload_index)
+        if uploader_name is None:
+            pending_queue.mark_searched(entry, run['current_time_utc'])
+            continue
+        pending_queue.resolve_pending(entry)
+        resolved.append((entry, uploader_name))
+
+    if resolved:
+        print(f"Found the uploader of {len(resolved)} files reported earlier")
+        pending_queue.patch_report(output_bucket, resolved)
  
-def main():
+def main(run):
+    current_time_utc, lambda_time_ran = run['current_time_utc'], run['lambda_time_ran']
     try:
-        # Fetch logs from the S3 bucket which is modified within the expected time interval
-        log_objects = list_all_objects(log_bucket, log_prefix)
+        # Fetch logs from the log buckets which are modified within the expected time interval
+        upload_index = build_upload_index(list(prefix_tries), current_time_utc)
+        recheck_pending(run, upload_index)
 
-        # Loop NFL Buckets
-        for nfl_bucket in bucket_names:
-            nfl_bucket_name, nfl_bucket_prefix = nfl_bucket.split(':')        
-            # List objects in the bucket as per given prefix
-            response = s3_client.list_objects_v2(Bucket=nfl_bucket_name, Prefix=nfl_bucket_prefix)
+        # List objects in every NFL bucket as per given prefix, the buckets are listed in parallel
+        listings = s3_lister.list_locations(
+            monitored_prefixes,
+            lambda nfl_bucket_name, nfl_bucket_prefix: s3_client.list_objects_v2(Bucket=nfl_bucket_name, Prefix=nfl_bucket_prefix)
+        )
+
+        # Loop NFL Buckets in the configured order
+        for (nfl_bucket_name, nfl_bucket_prefix), response in listings:
+            if isinstance(response, ClientError):
+                raise response
 
             if 'Contents' not in response:
                 send_notification(body=f"No files found in bucket: {nfl_bucket_name} with prefix: {nfl_bucket_prefix}.")
@@ -148,10 +199,16 @@ def main():
             # Flag to determine if any file have been modified in given time interval
             recent_files_found = False
 
-            for obj in response['Contents']:
+            # Files uploaded within the given time interval, filtered on the columnar listing.
+            # The Contents dicts are released once the listing is built, only the columns are read below
+            recent_listing = listing_columns.window_filter(
+                listing_columns.build_listing(response.pop('Contents')),
+                (current_time_utc - timedelta(hours=max_time_interval)).timestamp()
+            )
+
+            for nfl_file_key, nfl_etag, nfl_epoch, nfl_size in zip(recent_listing["key"], recent_listing["etag"], recent_listing["epoch"], recent_listing["size"]):
                 # absolute path (full path) of a selected file
-                nfl_file_key = obj['Key']
-                nfl_last_modified_time = obj['LastModified']
+                nfl_last_modified_time = datetime.fromtimestamp(int(nfl_epoch), tz=timezone.utc)
                 nfl_key_prefix = os.path.dirname(nfl_file_key)
                 nfl_filename = os.path.basename(nfl_file_key)
  
@@ -159,47 +216,101 @@ def main():
                 if not nfl_filename:
                     continue
 
-                # Check if the file was uploaded within the given time interval
-                if current_time_utc - nfl_last_modified_time <= timedelta(hours=max_time_interval):
-                    # recent_files_found defaults to False, if any file is modified it will return
-                    # true outside of loop
-                    recent_files_found = True
+                # recent_files_found defaults to False, if any file is modified it will return
+                # true outside of loop
+                recent_files_found = True
+                sla_engine.record_arrival(nfl_bucket_name, nfl_file_key, nfl_last_modified_time)
+
+                # with overlapping prefixes a file still counts as recent for every prefix listing it,
+                # but it is only reported under its longest monitored prefix
+                if prefix_trie.match_prefix(prefix_tries, nfl_bucket_name, nfl_file_key) != nfl_bucket_prefix:
+                    continue
+
+                # Skip files already reported by an earlier run, the window is longer than the schedule
+                if seen_set.is_seen(nfl_bucket_name, nfl_file_key, nfl_etag):
+                    continue
 
-                    # Get file/object uploader name
-                    uploader_name = fetch_uploader(nfl_file_key, nfl_bucket_name, log_objects)
+                # Get file/object uploader name
+                uploader_name = fetch_uploader(nfl_file_key, nfl_bucket_name, upload_index)
 
-                    # Skipping because logs are not generated and uploader is empty
-                    if uploader_name is None:
-                        uploader_name = "Logs not uploaded yet"
+                # Logs are not generated yet, the file is queued and its row in this run's report
+                # is patched by a later run once the uploader is found
+                if uploader_name is None:
+                    uploader_name = pending_queue.UNRESOLVED_UPLOADER
+                    pending_queue.add_pending(
+                        nfl_bucket_name, nfl_file_key, nfl_last_modified_time,
+                        report_writer.report_key(report_prefix, lambda_time_ran, nfl_bucket_name, nfl_last_modified_time), current_time_utc
+                    )
+                seen_set.mark_seen(nfl_bucket_name, nfl_file_key, nfl_etag)
 
-                    file_metadata = {
-                        "Bucket_name": nfl_bucket_name,
-                        "Prefix": nfl_key_prefix,
-                        "Filename": nfl_filename,
-                        "Uploader": uploader_name, 
-                        "Datetime_file_landed": nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'),
-                        "Datetime_lambda_ran": lambda_time_ran,
-                        "Error_if_any": "NoErrors"
+                file_metadata = {
+                    "Bucket_name": nfl_bucket_name,
+                    "Prefix": nfl_key_prefix,
+                    "Filename": nfl_filename,
+                    "Uploader": uploader_name, 
+                    "Datetime_file_landed": nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'),
+                    "Datetime_lambda_ran": lambda_time_ran,
+                    "Error_if_any": "NoErrors"
 
-                    }
-                    csv_data.append([nfl_bucket_name, file_metadata["Prefix"], file_metadata["Filename"], file_metadata["Uploader"], file_metadata["Datetime_file_landed"], file_metadata["Datetime_lambda_ran"], "NoErrors"])
-                    file_metadatas.append(file_metadata)
+                }
+                run['csv_data'].append([nfl_bucket_name, file_metadata["Prefix"], file_metadata["Filename"], file_metadata["Uploader"], file_metadata["Datetime_file_landed"], file_metadata["Datetime_lambda_ran"], "NoErrors"])
+                run['file_metadatas'].append(file_metadata)
+                reported_objects = run['reported_objects']
+                reported_objects['key'].append(f"{nfl_bucket_name}/{nfl_file_key}")
+                reported_objects['epoch'].append(int(nfl_epoch))
+                reported_objects['size'].append(int(nfl_size))
+                reported_objects['uploader'].append(uploader_name)
 
             if not recent_files_found:
                 send_notification(body=f"No recent files have been uploaded to bucket: {nfl_bucket_name}/{nfl_bucket_prefix}.")
   
     except Exception as e:
         error = str(e)
-        csv_data.append([nfl_bucket_name, nfl_bucket_name, nfl_filename, uploader_name, nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'), lambda_time_ran, error])
+        run['csv_data'].append([nfl_bucket_name, nfl_bucket_name, nfl_filename, uploader_name, nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'), lambda_time_ran, error])
         print(e)
         send_notification(body=f"An error occurred while processing bucket: {nfl_bucket_name}/{nfl_bucket_prefix} \n\nError: {str(e)}")
 
+def upload_totals(run):
+    # Files and bytes reported by this run per prefix, per uploader and per hour
+    reported_objects = run['reported_objects']
+    reported_listing = listing_columns.listing_from_columns(reported_objects['key'], reported_objects['epoch'], reported_objects['size'])
+    sections = [
+        ("Prefix", listing_columns.totals_by_prefix(reported_listing)),
+        ("Uploader", listing_columns.totals_by_uploader(reported_listing, reported_objects['uploader'])),
+        ("Hour", {
+            datetime.fromtimestamp(hour, tz=timezone.utc).strftime('%Y-%m-%d_%H:00'): total
+            for hour, total in listing_columns.totals_by_hour(reported_listing).items()
+        })
+    ]
+
+    totals = ""
+    for title, section in sections:
+        totals += f"Files per {title.lower()}:\n"
+        for name, (count, size) in sorted(section.items()):
+            totals += f"   - {title}: {name} : {count} files, {size/1024:.2f} KB\n"
+    return totals
+
+def check_sla(run):
+    # Alert once for every expected arrival whose grace period ended without a file
+    alerts = sla_engine.check_deadlines(run['current_time_utc'])
+    if alerts:
+        send_notification(body="Expected NFL files are missing:\n\n" + "\n".join(alerts))
+    sla_engine.save_sla_state()
+
+@profiling.profiled
 def lambda_handler(event, context):
-    main()
-    write_csv_to_s3()
+    # every invocation starts from a new run context, a warm container only keeps clients and caches
+    run = run_context.new_run(csv_header)
+    cost_accounting.reset()
+    log_cache.reset_stats()
+    main(run)
+    write_csv_to_s3(run)
+    seen_set.save_seen_set()
+    pending_queue.save_pending()
+    check_sla(run)
 
     # Create a Pandas DataFrame from the metadata list
-    df = pd.DataFrame(file_metadatas)
+    df = pd.DataFrame(run['file_metadatas'])
 
     formatted_data = ""
     for index, row in df.iterrows():
@@ -212,4 +323,4 @@ def lambda_handler(event, context):
         formatted_data += f"   - Error_if_any: {row['Error_if_any']}\n\n"
 
 
-    send_notification(body=f"NFL S3 file processing using Lambda Function : \n\nMetadata: \n\n{formatted_data}")
+    send_notification(body=f"NFL S3 file processing using Lambda Function : \n\nMetadata: \n\n{formatted_data}\n{upload_totals(run)}\n{log_cache.summary_text()}\n{cost_accounting.summary_text()}")
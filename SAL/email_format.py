@@ -4,8 +4,9 @@ import io
 import re
 import os
 import pandas as pd
+import run_context
 from botocore.exceptions import ClientError
-from datetime import datetime, timezone, timedelta
+from datetime import timedelta
  
 ###
 ## Generalized regex to match both IAM and AD user ARNs
@@ -24,27 +25,24 @@ log_prefix = "Awslogs/s3/"
  
 # bucket_names format = bucket01:prefix01,bucket02:prefix....
 bucket_names = os.getenv('BUCKET_NAMES').split(',')
-lambda_time_ran = datetime.utcnow().strftime('%Y-%m-%d_%H:%M:%S')
 
 # Bucket to store csv output
 output_bucket = os.getenv('OUTPUT_BUCKET', 'rtlab-petclinic-logstore-s3')
-output_csv_key = f'csv/nfl/log/{lambda_time_ran}_file_metadata.csv'
+output_csv_key_format = 'csv/nfl/log/{lambda_time_ran}_file_metadata.csv'
 sns_topic_arn = os.getenv('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:211125347349:lambda-py')
 
 max_time_interval = 50
-current_time_utc = datetime.utcnow().replace(tzinfo=timezone.utc)
 
-file_metadatas = []
-csv_data = [["Bucket_name", "Prefix", "Filename", "Uploader", "Datetime_file_landed", "Datetime_lambda_ran", "Error_if_any"]]
+csv_header = ["Bucket_name", "Prefix", "Filename", "Uploader", "Datetime_file_landed", "Datetime_lambda_ran", "Error_if_any"]
  
-def write_csv_to_s3():
+def write_csv_to_s3(run):
     try:
         csv_buffer = io.StringIO()
         writer = csv.writer(csv_buffer)
-        writer.writerows(csv_data)
+        writer.writerows(run['csv_data'])
  
-        s3_client.put_object(Bucket=output_bucket, Key=output_csv_key, Body=csv_buffer.getvalue())
-        print(f"CSV file uploaded to {output_bucket}/{output_csv_key}")
+        s3_client.put_object(Bucket=output_bucket, Key=run['output_csv_key'], Body=csv_buffer.getvalue())
+        print(f"CSV file uploaded to {output_bucket}/{run['output_csv_key']}")
  
     except ClientError as e:
         print(f"Error uploading CSV to S3: {e}")
@@ -61,7 +59,7 @@ def send_notification(body):
     except ClientError as e:
         print(f"Error sending metadata notification: {e}")
 
-def list_all_objects(log_bucket, log_prefix):
+def list_all_objects(log_bucket, log_prefix, current_time_utc):
     # list to append logs/objects
     log_objects = []
     continuation_token = None
@@ -130,10 +128,11 @@ def fetch_uploader(nfl_file_key, nfl_bucket_name, log_objects):
     except ClientError as e:
         print(e)
  
-def main():
+def main(run):
+    current_time_utc, lambda_time_ran = run['current_time_utc'], run['lambda_time_ran']
     try:
         # Fetch logs from the S3 bucket which is modified within the expected time interval
-        log_objects = list_all_objects(log_bucket, log_prefix)
+        log_objects = list_all_objects(log_bucket, log_prefix, current_time_utc)
 
         # Loop NFL Buckets
         for nfl_bucket in bucket_names:
@@ -180,24 +179,26 @@ def main():
                         "Datetime_file_landed": nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'),
                         "Datetime_lambda_ran": lambda_time_ran
                     }
-                    csv_data.append([nfl_bucket_name, file_metadata["Prefix"], file_metadata["Filename"], file_metadata["Uploader"], file_metadata["Datetime_file_landed"], file_metadata["Datetime_lambda_ran"], "NoErrors"])
-                    file_metadatas.append(file_metadata)
+                    run['csv_data'].append([nfl_bucket_name, file_metadata["Prefix"], file_metadata["Filename"], file_metadata["Uploader"], file_metadata["Datetime_file_landed"], file_metadata["Datetime_lambda_ran"], "NoErrors"])
+                    run['file_metadatas'].append(file_metadata)
 
             if not recent_files_found:
                 send_notification(body=f"No recent files have been uploaded to bucket: {nfl_bucket_name}/{nfl_bucket_prefix}.")
   
     except Exception as e:
         error = str(e)
-        csv_data.append([nfl_bucket_name, nfl_bucket_name, nfl_filename, uploader_name, nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'), lambda_time_ran, error])
+        run['csv_data'].append([nfl_bucket_name, nfl_bucket_name, nfl_filename, uploader_name, nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'), lambda_time_ran, error])
         print(e)
         send_notification(body=f"An error occurred while processing bucket: {nfl_bucket_name}/{nfl_bucket_prefix} \n\nError: {str(e)}")
 
 def lambda_handler(event, context):
-    main()
-    write_csv_to_s3()
+    # every invocation starts from a new run context, a warm container only keeps the clients
+    run = run_context.new_run(csv_header, output_csv_key_format)
+    main(run)
+    write_csv_to_s3(run)
 
     # Create a Pandas DataFrame from the metadata list
-    df = pd.DataFrame(file_metadatas)
+    df = pd.DataFrame(run['file_metadatas'])
 
     # Format the DataFrame for better readability
     df = df.style.set_properties(**{'text-align': 'left'})
@@ -1,10 +1,12 @@
 import boto3
-import csv
-import io
 import re
 import os
 from botocore.exceptions import ClientError
-from datetime import datetime, timezone, timedelta
+from datetime import timedelta
+
+import head_enrichment
+import report_writer
+import run_context
  
 ###
 ## Generalized regex to match both IAM and AD user ARNs
@@ -23,30 +25,24 @@ log_prefix = "Awslogs/s3/"
  
 # bucket_names format = bucket01:prefix01,bucket02:prefix....
 bucket_names = os.getenv('BUCKET_NAMES').split(',')
-lambda_time_ran = datetime.utcnow().strftime('%Y-%m-%d_%H:%M:%S')
 
 # Bucket to store csv output
 output_bucket = os.getenv('OUTPUT_BUCKET', 'rtlab-petclinic-logstore-s3')
-output_csv_key = f'csv/nfl/log/{lambda_time_ran}_file_metadata.csv'
+# reports are written under dt=YYYY-MM-DD/hour=HH/bucket=... partitions, see report_writer.
+# The columns differ from SAL/email.py, so the reports need their own prefix and Athena table
+report_prefix = os.getenv('REPORT_PREFIX', 'csv/nfl/log_with_size/')
 sns_topic_arn = os.getenv('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:211125347349:lambda-py')
 
 max_time_interval = 50
-current_time_utc = datetime.utcnow().replace(tzinfo=timezone.utc)
 
-file_metadatas = []
-csv_data = [["Bucket_name", "Prefix", "Filename", "Uploader", "Datetime_file_landed", "Datetime_lambda_ran", "Error_if_any"]]
- 
-def write_csv_to_s3():
-    try:
-        csv_buffer = io.StringIO()
-        writer = csv.writer(csv_buffer)
-        writer.writerows(csv_data)
+csv_header = ["Bucket_name", "Prefix", "Filename", "Uploader", "File_size", *head_enrichment.head_fields, "Datetime_file_landed", "Datetime_lambda_ran", "Error_if_any"]
  
-        s3_client.put_object(Bucket=output_bucket, Key=output_csv_key, Body=csv_buffer.getvalue())
-        print(f"CSV file uploaded to {output_bucket}/{output_csv_key}")
- 
-    except ClientError as e:
-        print(f"Error uploading CSV to S3: {e}")
+def write_csv_to_s3(run):
+    report_writer.write_report(
+        output_bucket, report_prefix, run['lambda_time_ran'], run['csv_data'][0], run['csv_data'][1:],
+        [nfl_bucket.split(':')[0] for nfl_bucket in bucket_names],
+        table_name='nfl_file_metadata_with_size', fallback_time=run['current_time_utc']
+    )
  
 def send_notification(body):
     try:
@@ -60,7 +56,7 @@ def send_notification(body):
     except ClientError as e:
         print(f"Error sending metadata notification: {e}")
 
-def list_all_objects(log_bucket, log_prefix):
+def list_all_objects(log_bucket, log_prefix, current_time_utc):
     # list to append logs/objects
     log_objects = []
     continuation_token = None
@@ -129,10 +125,11 @@ def fetch_uploader(nfl_file_key, nfl_bucket_name, log_objects):
     except ClientError as e:
         print(e)
  
-def main():
+def main(run):
+    current_time_utc, lambda_time_ran = run['current_time_utc'], run['lambda_time_ran']
     try:
         # Fetch logs from the S3 bucket which is modified within the expected time interval
-        log_objects = list_all_objects(log_bucket, log_prefix)
+        log_objects = list_all_objects(log_bucket, log_prefix, current_time_utc)
 
         # Loop NFL Buckets
         for nfl_bucket in bucket_names:
@@ -147,7 +144,16 @@ def main():
             # Flag to determine if any file have been modified in given time interval
             recent_files_found = False
 
-            for obj in response['Contents']:
+            # Files uploaded within the given time interval, skipping empty folder objects
+            recent_objects = [
+                obj for obj in response['Contents']
+                if os.path.basename(obj['Key']) and current_time_utc - obj['LastModified'] <= timedelta(hours=max_time_interval)
+            ]
+
+            # HEAD the recent files concurrently for the fields selected in HEAD_FIELDS
+            head_metadata = head_enrichment.enrich_objects(nfl_bucket_name, recent_objects)
+
+            for obj in recent_objects:
                 # absolute path (full path) of a selected file
                 nfl_file_key = obj['Key']
                 nfl_last_modified_time = obj['LastModified']
@@ -155,45 +161,45 @@ def main():
                 nfl_key_prefix = os.path.dirname(nfl_file_key)
                 nfl_filename = os.path.basename(nfl_file_key)
 
-                # skip if response returns empty folder as object
-                if not nfl_filename:
-                    continue
-
-                # Check if the file was uploaded within the given time interval
-                if current_time_utc - nfl_last_modified_time <= timedelta(hours=max_time_interval):
-                    # recent_files_found defaults to False, if any file is modified it will return
-                    # true outside of loop
-                    recent_files_found = True
-
-                    # Get file/object uploader name
-                    uploader_name = fetch_uploader(nfl_file_key, nfl_bucket_name, log_objects)
-
-                    # Skipping because logs are not generated and uploader is empty
-                    if uploader_name is None:
-                        uploader_name = "Logs not uploaded yet"
-
-                    file_metadata = {
-                        "Bucket": nfl_bucket_name,
-                        "Prefix": nfl_key_prefix,
-                        "Filename": nfl_filename,
-                        "Uploader": uploader_name,
-                        "File_size": nfl_file_size, 
-                        "Datetime_file_landed": nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'),
-                        "Datetime_lambda_ran": lambda_time_ran
-                    }
-                    csv_data.append([nfl_bucket_name, file_metadata["Prefix"], file_metadata["Filename"], file_metadata["Uploader"], file_metadata["File_size"], file_metadata["Datetime_file_landed"], file_metadata["Datetime_lambda_ran"], "NoErrors"])
-                    file_metadatas.append(file_metadata)
+                # recent_files_found defaults to False, if any file is modified it will return
+                # true outside of loop
+                recent_files_found = True
+
+                # Get file/object uploader name
+                uploader_name = fetch_uploader(nfl_file_key, nfl_bucket_name, log_objects)
+
+                # Skipping because logs are not generated and uploader is empty
+                if uploader_name is None:
+                    uploader_name = "Logs not uploaded yet"
+
+                file_metadata = {
+                    "Bucket": nfl_bucket_name,
+                    "Prefix": nfl_key_prefix,
+                    "Filename": nfl_filename,
+                    "Uploader": uploader_name,
+                    "File_size": nfl_file_size, 
+                    **head_metadata.get(nfl_file_key, {}),
+                    "Datetime_file_landed": nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'),
+                    "Datetime_lambda_ran": lambda_time_ran
+                }
+                run['csv_data'].append([nfl_bucket_name, file_metadata["Prefix"], file_metadata["Filename"], file_metadata["Uploader"], file_metadata["File_size"], *[file_metadata.get(field, '') for field in head_enrichment.head_fields], file_metadata["Datetime_file_landed"], file_metadata["Datetime_lambda_ran"], "NoErrors"])
+                run['file_metadatas'].append(file_metadata)
+                run['reported_locations'].append((nfl_bucket_name, nfl_file_key, obj['ETag']))
 
             if not recent_files_found:
                 send_notification(body=f"No recent files have been uploaded to bucket: {nfl_bucket_name}/{nfl_bucket_prefix}.")
   
     except ClientError as e:
         error = str(e)
-        csv_data.append([nfl_bucket_name, nfl_bucket_name, nfl_filename, uploader_name, nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'), lambda_time_ran, error])
+        run['csv_data'].append([nfl_bucket_name, nfl_bucket_name, nfl_filename, uploader_name, nfl_last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'), lambda_time_ran, error])
         print(e)
         send_notification(body=f"An error occurred while processing bucket: {nfl_bucket_name}/{nfl_bucket_prefix} \n\nError: {str(e)}")
 
 def lambda_handler(event, context):
-    main()
-    write_csv_to_s3()
-    send_notification(body=f"NFL S3 file processing using Lambda Function : \n\nMetadata: \n\n{file_metadatas}")
+    # every invocation starts from a new run context, a warm container only keeps clients and caches
+    run = run_context.new_run(csv_header)
+    run['reported_locations'] = []
+    main(run)
+    write_csv_to_s3(run)
+    head_enrichment.save_head_cache(run['reported_locations'])
+    send_notification(body=f"NFL S3 file processing using Lambda Function : \n\nMetadata: \n\n{run['file_metadatas']}")
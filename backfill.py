@@ -0,0 +1,134 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+import event_index
+import log_partitions
+import prefix_trie
+import report_writer
+
+# Regenerate reports for a past date range from the CloudTrail logs
+#
+# python backfill.py --start 2024-10-01 --end 2024-11-01 --slice day --workers 8
+# python backfill.py --start 2024-10-19T06 --end 2024-10-19T18 --slice hour --output file:///tmp/backfill
+#
+# The range is split in day or hour slices which are processed by parallel worker processes with the
+# same log selection and attribution as new/main.py, and every slice is written as its own report
+# in the partitioned layout of report_writer.
+
+log_bucket = os.getenv('LOG_BUCKET', 'aws-cloudtrail-logs-dataevent')
+partitions = log_partitions.parse_log_partitions(os.getenv('LOG_PARTITIONS', '211125347349:us-east-1'))
+organization_id = os.getenv('ORGANIZATION_ID')
+monitored_prefixes = prefix_trie.load_monitored_prefixes(os.getenv('BUCKET_NAMES', 'athena-glue-1205:csv/logs/'))
+
+output_bucket = os.getenv('OUTPUT_BUCKET')
+backfill_prefix = os.getenv('BACKFILL_PREFIX', 'nfl/backfill/')
+
+csv_header = ["Bucket_name", "Prefix", "Filename", "Uploader", "Datetime_file_landed", "Datetime_lambda_ran"]
+
+
+def parse_time(value):
+    for time_format in ('%Y-%m-%dT%H', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, time_format).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"{value} is not YYYY-MM-DD or YYYY-MM-DDTHH")
+
+
+def make_slices(start, end, slice_hours):
+    slices = []
+    slice_start = start
+    while slice_start < end:
+        slice_end = min(slice_start + timedelta(hours=slice_hours), end)
+        slices.append((slice_start, slice_end))
+        slice_start = slice_end
+    return slices
+
+
+def write_slice(output, slice_start, slice_hours, rows):
+    # Rows are written to the same dt/hour/bucket partitions as the reports of the handlers,
+    # every slice has its own manifest
+    label = slice_start.strftime('%Y-%m-%d') if slice_hours == 24 else slice_start.strftime('%Y-%m-%d_%H')
+    manifest = report_writer.write_report(
+        output, backfill_prefix, f"backfill_{label}", csv_header, rows,
+        [bucket_name for bucket_name, _ in monitored_prefixes], table_name='nfl_file_metadata_backfill'
+    )
+    return f"{len(manifest['partitions'])} partitions of {output}/{backfill_prefix}"
+
+
+def backfill_slice(slice_start, slice_end, routes, output):
+    # Read the CloudTrail files delivered for the slice and report every upload event within it
+    prefix_tries = prefix_trie.build_prefix_tries(monitored_prefixes)
+    time_ranges = [[
+        slice_start - timedelta(minutes=event_index.event_lead_time),
+        slice_end + timedelta(minutes=event_index.cloudtrail_delivery_delay)
+    ]]
+
+    upload_index = {}
+    for (account, region, _), routed_buckets in routes.items():
+        partition_prefix = log_partitions.cloudtrail_prefix(account, region, organization_id)
+        partition_index = event_index.scan_cloudtrail_prefix(
+            log_bucket, partition_prefix, {routed_bucket: prefix_tries[routed_bucket] for routed_bucket in routed_buckets},
+            None, None, time_ranges=time_ranges, partition=(account, region)
+        )
+        event_index.merge_indexes(upload_index, partition_index)
+
+    lambda_time_ran = datetime.utcnow().strftime('%Y-%m-%d_%H:%M:%S')
+    start_epoch, end_epoch = slice_start.timestamp(), slice_end.timestamp()
+    rows = []
+    for bucket_name, file_key in sorted(upload_index):
+        # skip folder objects
+        if not os.path.basename(file_key):
+            continue
+        times, usernames = upload_index[(bucket_name, file_key)]
+        for epoch, username in zip(times, usernames):
+            if start_epoch <= epoch < end_epoch:
+                landed = datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%d_%H:%M:%S')
+                rows.append([bucket_name, os.path.dirname(file_key), os.path.basename(file_key), username, landed, lambda_time_ran])
+
+    slice_hours = round((slice_end - slice_start).total_seconds() / 3600)
+    location = write_slice(output, slice_start, slice_hours, rows)
+    return slice_start, len(rows), location
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill NFL S3 file metadata reports for a past date range")
+    parser.add_argument('--start', type=parse_time, required=True, help="YYYY-MM-DD or YYYY-MM-DDTHH (UTC)")
+    parser.add_argument('--end', type=parse_time, required=True, help="YYYY-MM-DD or YYYY-MM-DDTHH (UTC), exclusive")
+    parser.add_argument('--slice', choices=['day', 'hour'], default='day')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default=output_bucket, help="report bucket, or file:///path for local reports")
+    args = parser.parse_args()
+
+    if not args.output:
+        parser.error("--output or OUTPUT_BUCKET is required")
+
+    # Routing needs one get_bucket_location per bucket, so it is done once instead of in every worker
+    routes = log_partitions.route_buckets(partitions, [bucket_name for bucket_name, _ in monitored_prefixes])
+    slice_hours = 24 if args.slice == 'day' else 1
+    slices = make_slices(args.start, args.end, slice_hours)
+    print(f"Backfilling {len(slices)} slices from {args.start} to {args.end} with {args.workers} workers")
+
+    total_rows = 0
+    # spawn, so the workers create their own boto3 clients instead of sharing the parent's connections
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(backfill_slice, slice_start, slice_end, routes, args.output) for slice_start, slice_end in slices]
+        for future in futures:
+            try:
+                slice_start, row_count, location = future.result()
+            except ClientError as e:
+                print(f"An error occurred while backfilling a slice : error : {e}")
+                continue
+            total_rows += row_count
+            print(f"{slice_start:%Y-%m-%d %H:00} : {row_count} files written to {location}")
+
+    print(f"Backfill finished, {total_rows} files reported")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import threading
+
+import boto3
+
+# Counts requests, response bytes and retries per (service, operation, bucket) for every boto3 client
+# created from the default session. Import this module before any module creating a client,
+# clients copy the session's event hooks when they are created.
+
+# USD per request (us-east-1 list prices), operations not listed are counted but not priced
+REQUEST_PRICES = {
+    ('s3', 'PutObject'): 0.005 / 1000,
+    ('s3', 'CopyObject'): 0.005 / 1000,
+    ('s3', 'ListObjectsV2'): 0.005 / 1000,
+    ('s3', 'ListBuckets'): 0.005 / 1000,
+    ('s3', 'GetObject'): 0.0004 / 1000,
+    ('s3', 'HeadObject'): 0.0004 / 1000,
+    ('s3', 'GetBucketLocation'): 0.0004 / 1000,
+    ('sns', 'Publish'): 0.50 / 1000000,
+}
+
+# (service, operation, bucket) -> [requests, retries, response bytes]
+usage = {}
+_lock = threading.Lock()
+
+
+def _remember_bucket(params, context, **kwargs):
+    context['accounting_bucket'] = params.get('Bucket', '')
+
+
+def _count_call(http_response, parsed, model, context, **kwargs):
+    service = model.service_model.service_name
+    retries = (parsed or {}).get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    response_bytes = 0
+    if http_response is not None:
+        response_bytes = int(http_response.headers.get('content-length', 0) or 0)
+
+    location = (service, model.name, context.get('accounting_bucket', ''))
+    with _lock:
+        counters = usage.setdefault(location, [0, 0, 0])
+        counters[0] += 1 + retries
+        counters[1] += retries
+        counters[2] += response_bytes
+
+
+def register(session=None):
+    session = session or boto3._get_default_session()
+    session.events.register('before-parameter-build.*.*', _remember_bucket, unique_id='cost-accounting-bucket')
+    session.events.register('after-call.*.*', _count_call, unique_id='cost-accounting-call')
+
+
+def reset():
+    with _lock:
+        usage.clear()
+
+
+def estimated_cost():
+    return sum(REQUEST_PRICES.get((service, operation), 0) * counters[0] for (service, operation, _), counters in usage.items())
+
+
+def totals_by_operation():
+    totals = {}
+    for (service, operation, _), counters in usage.items():
+        total = totals.setdefault(f"{service}.{operation}", [0, 0, 0])
+        for i, value in enumerate(counters):
+            total[i] += value
+    return totals
+
+
+def summary_text():
+    lines = ["API usage of this run:"]
+    for operation, (requests, retries, response_bytes) in sorted(totals_by_operation().items()):
+        lines.append(f"   - {operation}: {requests} requests, {retries} retries, {response_bytes / 1024:.1f} KB")
+    for (service, operation, bucket), (requests, retries, response_bytes) in sorted(usage.items()):
+        if bucket:
+            lines.append(f"   - {service}.{operation} {bucket}: {requests} requests, {response_bytes / 1024:.1f} KB")
+    lines.append(f"   - Estimated request cost: ${estimated_cost():.6f}")
+    return "\n".join(lines)
+
+
+def summary_metadata():
+    # Small enough to be attached as S3 user metadata (2 KB limit) of the report
+    totals = totals_by_operation()
+    return {
+        'api-requests': str(sum(total[0] for total in totals.values())),
+        'api-retries': str(sum(total[1] for total in totals.values())),
+        'api-response-bytes': str(sum(total[2] for total in totals.values())),
+        'estimated-cost-usd': f"{estimated_cost():.6f}",
+    }
+
+
+register()
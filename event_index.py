@@ -0,0 +1,235 @@
+import bisect
+import calendar
+import gzip
+import io
+import json
+import mmap
+import os
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+import log_cache
+import log_source
+import prefix_trie
+
+# Every event which creates or replaces an object
+UPLOAD_EVENTS = ('PutObject', 'CompleteMultipartUpload', 'CopyObject')
+
+# CloudTrail delivers a log file within this many minutes after the events it holds
+cloudtrail_delivery_delay = int(os.getenv('CLOUDTRAIL_DELIVERY_DELAY', '30'))
+# Events may be recorded slightly before the object's LastModified
+event_lead_time = 5  # in minutes
+
+# An event further than this from the object's LastModified belongs to another upload of the same key
+max_event_skew = int(os.getenv('ATTRIBUTION_MAX_SKEW', '3600'))  # in seconds
+
+
+def is_multipart(etag):
+    # Multipart uploads have an ETag ending with -<number of parts>. Their LastModified is the time the
+    # upload was initiated, the CompleteMultipartUpload event can come any time later.
+    return '-' in (etag or '')
+
+
+def read_log_lines(log_content, log_key):
+    # Decompress gzipped formatted logs, plain logs are used as they are.
+    # Memory mapped local files (see log_source) are read by gzip directly.
+    if log_content[:2] == b'\x1f\x8b':
+        try:
+            with gzip.GzipFile(fileobj=log_content if isinstance(log_content, mmap.mmap) else io.BytesIO(log_content)) as log_file:
+                return [line.decode('utf-8') for line in log_file]
+        except (OSError, EOFError) as e:
+            print(f"Skipping corrupted gzipped file: {log_key} : error : {e}")
+            return []
+    return log_content[:].decode('utf-8').splitlines()
+
+
+def list_recent_logs(log_bucket, prefix, current_time_utc, max_time_interval):
+    # List every log file under prefix which was delivered within the 'max_time_interval'
+    logs = []
+    for log in log_source.list_logs(log_bucket, prefix):
+        if current_time_utc - log['LastModified'] <= timedelta(hours=max_time_interval):
+            logs.append(log)
+    return logs
+
+
+def log_key_time(log_key):
+    # CloudTrail file names embed the delivery time:
+    # account_CloudTrail_region_YYYYMMDDTHHMMZ_unique.json.gz
+    try:
+        return datetime.strptime(log_key.rsplit('/', 1)[-1].split('_')[3], '%Y%m%dT%H%MZ').replace(tzinfo=timezone.utc)
+    except (IndexError, ValueError):
+        return None
+
+
+def upload_time_ranges(upload_times, multipart_times=(), until=None):
+    # Merge the delivery time ranges [LastModified - lead time, LastModified + delivery delay]
+    # of every upload into the fewest non overlapping ranges.
+    # Multipart uploads (see is_multipart) complete after their LastModified, their range goes up to 'until'.
+    uploads = [(upload_time, upload_time + timedelta(minutes=cloudtrail_delivery_delay)) for upload_time in upload_times]
+    uploads.extend((upload_time, max(until or upload_time, upload_time + timedelta(minutes=cloudtrail_delivery_delay))) for upload_time in multipart_times)
+    ranges = []
+    for upload_time, end in sorted(uploads):
+        start = upload_time - timedelta(minutes=event_lead_time)
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def list_logs_in_range(log_bucket, log_prefix, account, region, start, end, delivered_after=None):
+    # List only the log files delivered between start and end: the listing of every day folder
+    # starts after the key of 'start' and stops at the first key delivered after 'end'.
+    # The day before and after are checked as well (see scan_cloudtrail_prefix), which costs
+    # a single request each. With delivered_after, files which landed in the log bucket before
+    # that time (already read by an earlier run) are skipped.
+    logs = []
+    day = (start - timedelta(days=1)).date()
+    while day <= (end + timedelta(days=1)).date():
+        day_prefix = f"{log_prefix}{day.strftime('%Y/%m/%d')}/"
+        start_after = f"{day_prefix}{account}_CloudTrail_{region}_{start.strftime('%Y%m%dT%H%MZ')}"
+        for log in log_source.list_logs(log_bucket, day_prefix, start_after):
+            # keys are sorted by delivery time, so the rest of the folder is after 'end'
+            if (log_key_time(log['Key']) or start) > end:
+                break
+            if delivered_after and log['LastModified'] <= delivered_after:
+                continue
+            logs.append(log)
+        day += timedelta(days=1)
+    return logs
+
+
+def parse_event_time(event_time):
+    # eventTime format: 2024-10-19T14:03:11Z
+    return calendar.timegm(datetime.strptime(event_time, '%Y-%m-%dT%H:%M:%SZ').timetuple())
+
+
+def add_upload_event(index, location, epoch, username):
+    # Every (bucket, key) keeps two parallel lists: event times and uploader names
+    timeline = index.get(location)
+    if timeline is None:
+        timeline = index[location] = ([], [])
+    timeline[0].append(epoch)
+    timeline[1].append(username)
+
+
+def sort_index(index):
+    # Sort every timeline by event time so it can be searched with bisect
+    for location, (times, usernames) in index.items():
+        if any(earlier > later for earlier, later in zip(times, times[1:])):
+            ordered = sorted(zip(times, usernames))
+            index[location] = ([epoch for epoch, _ in ordered], [username for _, username in ordered])
+    return index
+
+
+def merge_indexes(index, other):
+    for location, (times, usernames) in other.items():
+        if location not in index:
+            index[location] = (times, usernames)
+            continue
+        for epoch, username in zip(times, usernames):
+            add_upload_event(index, location, epoch, username)
+    return sort_index(index)
+
+
+def lookup_uploader(index, bucket_name, file_key, last_modified_time, multipart=False):
+    # Return the uploader of the event closest to the object's LastModified.
+    # For a multipart upload it is the first event at or after LastModified, however long the upload took:
+    # a later upload of the same key would have changed LastModified.
+    timeline = index.get((bucket_name, file_key))
+    if timeline is None:
+        return None
+
+    times, usernames = timeline
+    target = calendar.timegm(last_modified_time.utctimetuple())
+    position = bisect.bisect_left(times, target)
+    if multipart and position < len(times):
+        return usernames[position]
+
+    # the closest event is either the first one at/after LastModified or the one right before it
+    candidates = [i for i in (position - 1, position) if 0 <= i < len(times)]
+    closest = min(candidates, key=lambda i: abs(times[i] - target))
+    if abs(times[closest] - target) > max_event_skew:
+        return None
+    return usernames[closest]
+
+
+def parse_upload_events(log_content, log_key):
+    # Successful upload events of a log file as (bucket, key, epoch, username)
+    events = []
+    for line in read_log_lines(log_content, log_key):
+        try:
+            event_data = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"Skipping invalid JSON line in file: {log_key} : error : {e}")
+            continue
+
+        for record in event_data.get('Records', []):
+            if record.get('eventName') not in UPLOAD_EVENTS or record.get('errorCode'):
+                continue
+            request_params = record.get('requestParameters') or {}
+            username = record.get('userIdentity', {}).get('arn', 'Unknown').split('/')[-1]
+            events.append((request_params.get('bucketName'), request_params.get('key'), parse_event_time(record['eventTime']), username))
+    return events
+
+
+def index_upload_events(events, prefix_tries, index):
+    # Add the events under the monitored prefixes (see prefix_trie) to the (bucket, key) timelines of index
+    for bucket_name, file_key, epoch, username in events:
+        if prefix_trie.is_monitored(prefix_tries, bucket_name, file_key):
+            add_upload_event(index, (bucket_name, file_key), epoch, username)
+
+
+def index_cloudtrail_log(log_content, log_key, prefix_tries, index):
+    index_upload_events(parse_upload_events(log_content, log_key), prefix_tries, index)
+
+
+def index_log_file(log_bucket, log, prefix_tries, index):
+    # The upload events of a log file seen by an earlier invocation come from log_cache,
+    # the file is only read and parsed when it is not cached or its ETag changed
+    events = log_cache.get(log_bucket, log['Key'], log.get('ETag'))
+    if events is None:
+        events = parse_upload_events(log_source.read_log(log_bucket, log['Key'], log.get('ETag')), log['Key'])
+        log_cache.put(log_bucket, log['Key'], log.get('ETag'), events)
+    index_upload_events(events, prefix_tries, index)
+
+
+def scan_cloudtrail_prefix(log_bucket, log_prefix, prefix_tries, current_time_utc, max_time_interval, time_ranges=None, partition=None, delivered_after=None):
+    # With time_ranges (see upload_time_ranges) only the log files delivered in those ranges are read,
+    # otherwise every log file delivered within the 'max_time_interval'
+    index = {}
+
+    if time_ranges is not None:
+        account, region = partition
+        logs = []
+        for start, end in time_ranges:
+            try:
+                logs.extend(list_logs_in_range(log_bucket, log_prefix, account, region, start, end, delivered_after))
+            except ClientError as e:
+                print(f"Unable to list logs in the bucket {log_bucket}/{log_prefix} from {start} to {end} : error : {e}")
+        print(f"Reading {len(logs)} log files of {log_bucket}/{log_prefix} for {len(time_ranges)} upload time ranges")
+        for log in logs:
+            index_log_file(log_bucket, log, prefix_tries, index)
+        return sort_index(index)
+
+    # Timezone in S3 bucket event is recorded as UTC, however, in cloud trail its in UTC-4
+    # Hence, we are checking for S3 object put events under Today, Yesterday and Tomorrow's log.
+    days_offset = [0, -1, 1]
+
+    for offset in days_offset:
+        day_prefix = f"{log_prefix}{(current_time_utc + timedelta(days=offset)).strftime('%Y/%m/%d')}"
+        try:
+            logs = list_recent_logs(log_bucket, day_prefix, current_time_utc, max_time_interval)
+        except ClientError as e:
+            print(f"Unable to list logs in the bucket {log_bucket}/{day_prefix} : error : {e}")
+            continue
+
+        if not logs:
+            print(f"No logs found in the bucket {log_bucket}/{day_prefix}.")
+            continue
+
+        for log in logs:
+            index_log_file(log_bucket, log, prefix_tries, index)
+
+    return sort_index(index)
@@ -0,0 +1,89 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+import state_store
+
+s3_client = boto3.client('s3')
+
+# Report column -> how it is read from the head_object response
+HEAD_FIELDS = {
+    "Content_type": lambda head: head.get('ContentType', ''),
+    "Storage_class": lambda head: head.get('StorageClass', 'STANDARD'),
+    "ETag": lambda head: head.get('ETag', '').strip('"'),
+    "User_metadata": lambda head: json.dumps(head.get('Metadata', {}), sort_keys=True),
+    "Encryption": lambda head: head.get('ServerSideEncryption', 'None'),
+    "KMS_key_id": lambda head: head.get('SSEKMSKeyId', ''),
+}
+
+# head_fields format = Content_type,Storage_class.... nothing is HEADed when it is empty
+head_fields = [field for field in os.getenv('HEAD_FIELDS', '').split(',') if field in HEAD_FIELDS]
+max_head_workers = int(os.getenv('HEAD_WORKERS', '16'))
+
+# Optional location where the cache is kept between cold starts: s3://bucket/key, or a local path
+head_cache_location = os.getenv('HEAD_CACHE_LOCATION')
+
+# (bucket, key, etag) -> {field: value}, an object with the same ETag has the same metadata
+head_cache = {}
+_loaded = False
+
+
+def load_head_cache():
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    if not head_cache_location:
+        return
+
+    entries = state_store.load_state(head_cache_location, "HEAD cache") or []
+    for bucket_name, file_key, etag, fields in entries:
+        head_cache.setdefault((bucket_name, file_key, etag), fields)
+
+
+def save_head_cache(locations):
+    # Only entries of the files reported in this run are kept, in memory and in the saved copy,
+    # so the cache stays as small as the window in a warm container too
+    kept = {location: head_cache[location] for location in locations if location in head_cache}
+    head_cache.clear()
+    head_cache.update(kept)
+    if not head_cache_location:
+        return
+    state_store.save_state(head_cache_location, "HEAD cache", [[*location, fields] for location, fields in kept.items()])
+
+
+def _head(bucket_name, obj):
+    # Every field is kept in the cache, so a later run can select other fields without a new HEAD
+    try:
+        head = s3_client.head_object(Bucket=bucket_name, Key=obj['Key'], IfMatch=obj['ETag'])
+    except ClientError as e:
+        # the object was replaced or deleted since it was listed
+        print(f"Unable to HEAD {bucket_name}/{obj['Key']} : error : {e}")
+        return None
+    return {field: HEAD_FIELDS[field](head) for field in HEAD_FIELDS}
+
+
+def enrich_objects(bucket_name, objects, fields=None):
+    # Return {key: {field: value}} for the listed objects, HEADing only objects whose
+    # (key, ETag) has not been seen before
+    fields = head_fields if fields is None else fields
+    if not fields or not objects:
+        return {}
+
+    load_head_cache()
+    missing = [obj for obj in objects if (bucket_name, obj['Key'], obj['ETag']) not in head_cache]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(max_head_workers, len(missing))) as executor:
+            for obj, result in zip(missing, executor.map(lambda obj: _head(bucket_name, obj), missing)):
+                if result is not None:
+                    head_cache[(bucket_name, obj['Key'], obj['ETag'])] = result
+        print(f"HEAD {len(missing)} of {len(objects)} objects in {bucket_name}, {len(objects) - len(missing)} from cache")
+
+    enriched = {}
+    for obj in objects:
+        cached = head_cache.get((bucket_name, obj['Key'], obj['ETag']), {})
+        enriched[obj['Key']] = {field: cached.get(field, '') for field in fields}
+    return enriched
@@ -0,0 +1,177 @@
+import csv
+import gzip
+import io
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote
+
+import boto3
+from botocore.exceptions import ClientError
+
+# pyarrow is only needed for Parquet inventories
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+s3_client = boto3.client('s3')
+
+# ETag, Size and LastModifiedDate are optional inventory fields, an inventory without them can't be used
+REQUIRED_FIELDS = {
+    'CSV': ('Key', 'Size', 'LastModifiedDate', 'ETag'),
+    'PARQUET': ('key', 'size', 'last_modified_date', 'e_tag')
+}
+
+# inventory_sources format = bucket01=inventory_bucket01:inventory/bucket01/config01/,bucket02=...
+# the prefix points at the inventory configuration folder holding the dated manifest folders
+inventory_sources = {}
+for entry in os.getenv('INVENTORY_SOURCES', '').split(','):
+    if entry:
+        source_bucket, destination = entry.split('=')
+        destination_bucket, destination_prefix = destination.split(':', 1)
+        inventory_sources[source_bucket] = (destination_bucket, destination_prefix)
+
+
+def find_latest_manifest(destination_bucket, destination_prefix):
+    # Inventory folders are named by creation time (YYYY-MM-DDTHH-MMZ), so the last one is the newest
+    paginator = s3_client.get_paginator('list_objects_v2')
+    folders = []
+    for page in paginator.paginate(Bucket=destination_bucket, Prefix=destination_prefix, Delimiter='/'):
+        folders.extend(common_prefix['Prefix'] for common_prefix in page.get('CommonPrefixes', []))
+
+    for folder in sorted(folders, reverse=True):
+        try:
+            body = s3_client.get_object(Bucket=destination_bucket, Key=f"{folder}manifest.json")['Body'].read()
+        except ClientError:
+            # delivery of this inventory is not complete yet
+            continue
+        return json.loads(body)
+
+    return None
+
+
+def manifest_time(manifest):
+    # creationTimestamp is in milliseconds since epoch
+    return datetime.fromtimestamp(int(manifest['creationTimestamp']) / 1000, tz=timezone.utc)
+
+
+def unusable_reason(manifest):
+    # Why the inventory of manifest can't be read, None when it can
+    file_format = manifest.get('fileFormat', '').upper()
+    if file_format not in REQUIRED_FIELDS:
+        return f"unsupported inventory format {file_format}"
+    if file_format == 'PARQUET' and pq is None:
+        return "pyarrow is required to read Parquet inventory files"
+
+    # fileSchema is a comma separated list for CSV and a Parquet message definition for Parquet
+    schema_fields = set(re.findall(r'\w+', manifest.get('fileSchema', '')))
+    missing = [field for field in REQUIRED_FIELDS[file_format] if field not in schema_fields]
+    if missing:
+        return f"the inventory has no {', '.join(missing)} field"
+    return None
+
+
+def _inventory_object(record):
+    # Shape an inventory record like a list_objects_v2 'Contents' entry
+    return {
+        'Key': record['Key'],
+        'LastModified': record['LastModifiedDate'],
+        'ETag': f'"{record["ETag"]}"',
+        'Size': int(record['Size'] or 0)
+    }
+
+
+def _iter_csv_file(destination_bucket, file_key, schema):
+    body = s3_client.get_object(Bucket=destination_bucket, Key=file_key)['Body']
+    with gzip.GzipFile(fileobj=body) as inventory_file:
+        for row in csv.reader(io.TextIOWrapper(inventory_file, encoding='utf-8')):
+            record = dict(zip(schema, row))
+            # keys are URL encoded in CSV inventories
+            record['Key'] = unquote(record['Key'])
+            record['LastModifiedDate'] = datetime.strptime(record['LastModifiedDate'], '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+            yield record
+
+
+def _iter_parquet_file(destination_bucket, file_key):
+    if pq is None:
+        raise RuntimeError("pyarrow is required to read Parquet inventory files")
+
+    body = s3_client.get_object(Bucket=destination_bucket, Key=file_key)['Body'].read()
+    parquet_file = pq.ParquetFile(io.BytesIO(body))
+    for batch in parquet_file.iter_batches(columns=['key', 'size', 'last_modified_date', 'e_tag']):
+        for row in batch.to_pylist():
+            yield {
+                'Key': row['key'],
+                'Size': row['size'],
+                'LastModifiedDate': row['last_modified_date'].replace(tzinfo=timezone.utc),
+                'ETag': row['e_tag']
+            }
+
+
+def iter_inventory_objects(manifest, prefix, window_start):
+    # Stream the inventory data files and yield the objects under prefix modified after window_start
+    destination_bucket = manifest['destinationBucket'].split(':::')[-1]
+    file_format = manifest['fileFormat'].upper()
+    schema = [field.strip() for field in manifest.get('fileSchema', '').split(',')]
+
+    for inventory_file in manifest['files']:
+        if file_format == 'CSV':
+            records = _iter_csv_file(destination_bucket, inventory_file['key'], schema)
+        elif file_format == 'PARQUET':
+            records = _iter_parquet_file(destination_bucket, inventory_file['key'])
+        else:
+            print(f"Unsupported inventory format {file_format}, skipping {inventory_file['key']}")
+            continue
+
+        for record in records:
+            if record['Key'].startswith(prefix) and record['LastModifiedDate'] >= window_start:
+                yield _inventory_object(record)
+
+
+def gap_objects(bucket_name, prefix, upload_index, since):
+    # Objects uploaded after the inventory was taken are not listed, they are found from the
+    # upload events and confirmed with a HEAD
+    objects = []
+    since_epoch = since.timestamp()
+    for (event_bucket, file_key), (times, _) in upload_index.items():
+        if event_bucket != bucket_name or not file_key or not file_key.startswith(prefix) or times[-1] < since_epoch:
+            continue
+        try:
+            head = s3_client.head_object(Bucket=bucket_name, Key=file_key)
+        except ClientError as e:
+            # the object was deleted after it was uploaded
+            print(f"Skipping {bucket_name}/{file_key} : error : {e}")
+            continue
+        objects.append({'Key': file_key, 'LastModified': head['LastModified'], 'ETag': head['ETag'], 'Size': head['ContentLength']})
+    return sorted(objects, key=lambda obj: obj['Key'])
+
+
+def list_window_objects(bucket_name, prefix, current_time_utc, max_time_interval, upload_index):
+    # Objects modified within 'max_time_interval' taken from the latest inventory plus the gap after it,
+    # None when the bucket has no usable inventory
+    destination_bucket, destination_prefix = inventory_sources[bucket_name]
+    manifest = find_latest_manifest(destination_bucket, destination_prefix)
+    if manifest is None:
+        print(f"No inventory found for {bucket_name} in {destination_bucket}/{destination_prefix}")
+        return None
+
+    # checked before any data file is read, so the bucket falls back to the listing instead of failing the run
+    reason = unusable_reason(manifest)
+    if reason:
+        print(f"Skipping the inventory of {bucket_name} in {destination_bucket}/{destination_prefix} : {reason}")
+        return None
+
+    window_start = current_time_utc - timedelta(hours=max_time_interval)
+    inventory_time = manifest_time(manifest)
+    objects = {obj['Key']: obj for obj in iter_inventory_objects(manifest, prefix, window_start)}
+
+    # objects uploaded again after the inventory replace the inventory entry, the gap starts an hour
+    # before the manifest because the inventory is built from a listing taken before it was written
+    gap_start = max(window_start, inventory_time - timedelta(hours=1))
+    for obj in gap_objects(bucket_name, prefix, upload_index, gap_start):
+        objects[obj['Key']] = obj
+
+    print(f"Inventory of {bucket_name} from {inventory_time} returned {len(objects)} objects for {prefix}")
+    return [objects[key] for key in sorted(objects)]
@@ -0,0 +1,147 @@
+import os
+from array import array
+
+# NumPy is optional, when it is installed the columns are numpy arrays and filters and
+# group-by totals are vectorized, otherwise the columns stay python arrays
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# A listing is held as columns instead of one dict per object:
+#   key       object keys (python list)
+#   etag      object ETags (python list)
+#   epoch     LastModified in epoch seconds (int64)
+#   size      object size in bytes (int64)
+#   prefix_id id of the key's folder in prefix_names, every folder is stored once
+#   row       position of the object in the listing it was built from
+
+# columns of python objects, the others are int64 arrays
+OBJECT_COLUMNS = ("key", "etag", "prefix_names")
+
+
+def _to_column(values):
+    return np.frombuffer(values, dtype=np.int64).copy() if np is not None else values
+
+
+def build_listing(objects):
+    # objects are list_objects_v2 'Contents' entries (or anything shaped like them),
+    # they are read once so a generator over millions of objects is not held in memory
+    keys, etags = [], []
+    epochs, sizes = array('q'), array('q')
+
+    for obj in objects:
+        keys.append(obj['Key'])
+        etags.append(obj.get('ETag'))
+        epochs.append(int(obj['LastModified'].timestamp()))
+        sizes.append(int(obj.get('Size', 0)))
+
+    return listing_from_columns(keys, epochs, sizes, etags)
+
+
+def listing_from_columns(keys, epochs, sizes, etags=None):
+    # keys and etags are lists, epochs and sizes python arrays of int64 ('q')
+    prefix_ids = array('q')
+    prefix_names = []
+    prefix_lookup = {}
+
+    for key in keys:
+        prefix = os.path.dirname(key)
+        prefix_id = prefix_lookup.get(prefix)
+        if prefix_id is None:
+            prefix_id = prefix_lookup[prefix] = len(prefix_names)
+            prefix_names.append(prefix)
+        prefix_ids.append(prefix_id)
+
+    return {
+        "key": keys,
+        "etag": etags if etags is not None else [None] * len(keys),
+        "epoch": _to_column(epochs),
+        "size": _to_column(sizes),
+        "prefix_id": _to_column(prefix_ids),
+        "row": _to_column(array('q', range(len(keys)))),
+        "prefix_names": prefix_names
+    }
+
+
+def listing_length(listing):
+    return len(listing["key"])
+
+
+def take_rows(listing, mask):
+    # Keep only the rows where mask is true
+    if np is not None:
+        mask = np.asarray(mask, dtype=bool)
+        taken = {name: values[mask] for name, values in listing.items() if name not in OBJECT_COLUMNS}
+    else:
+        taken = {
+            name: array('q', (value for value, keep in zip(values, mask) if keep))
+            for name, values in listing.items() if name not in OBJECT_COLUMNS
+        }
+    for name in ("key", "etag"):
+        taken[name] = [value for value, keep in zip(listing[name], mask) if keep]
+    taken["prefix_names"] = listing["prefix_names"]
+    return taken
+
+
+def window_filter(listing, start_epoch, end_epoch=None):
+    # Rows modified at or after start_epoch (and before end_epoch)
+    epochs = listing["epoch"]
+    if np is not None:
+        mask = epochs >= start_epoch
+        if end_epoch is not None:
+            mask &= epochs < end_epoch
+    else:
+        mask = [start_epoch <= epoch and (end_epoch is None or epoch < end_epoch) for epoch in epochs]
+    return take_rows(listing, mask)
+
+
+def _group_totals(group_ids, sizes, group_count):
+    # (object count, bytes) of every group id from 0 to group_count - 1
+    if np is not None:
+        counts = np.bincount(group_ids, minlength=group_count)
+        total_bytes = np.bincount(group_ids, weights=sizes, minlength=group_count)
+        return [(int(count), int(size)) for count, size in zip(counts, total_bytes)]
+
+    totals = [[0, 0] for _ in range(group_count)]
+    for group_id, size in zip(group_ids, sizes):
+        totals[group_id][0] += 1
+        totals[group_id][1] += size
+    return [tuple(total) for total in totals]
+
+
+def _intern(values):
+    # Map every value to a dense id: (ids, distinct values)
+    if np is not None:
+        names, ids = np.unique(np.asarray(values), return_inverse=True)
+        return ids.reshape(-1), names.tolist()
+    lookup = {}
+    names = []
+    ids = array('q')
+    for value in values:
+        value_id = lookup.get(value)
+        if value_id is None:
+            value_id = lookup[value] = len(names)
+            names.append(value)
+        ids.append(value_id)
+    return ids, names
+
+
+def totals_by_prefix(listing):
+    totals = _group_totals(listing["prefix_id"], listing["size"], len(listing["prefix_names"]))
+    return {prefix: total for prefix, total in zip(listing["prefix_names"], totals) if total[0]}
+
+
+def totals_by_hour(listing):
+    # keyed by the epoch of the start of the hour
+    hours = listing["epoch"] // 3600 if np is not None else array('q', (epoch // 3600 for epoch in listing["epoch"]))
+    hour_ids, hour_names = _intern(hours)
+    totals = _group_totals(hour_ids, listing["size"], len(hour_names))
+    return {int(hour) * 3600: total for hour, total in zip(hour_names, totals)}
+
+
+def totals_by_uploader(listing, uploaders):
+    # uploaders holds the uploader of every row of the listing
+    uploader_ids, uploader_names = _intern(uploaders)
+    totals = _group_totals(uploader_ids, listing["size"], len(uploader_names))
+    return dict(zip(uploader_names, totals))
@@ -0,0 +1,69 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Parsed upload events of the log files read by earlier invocations of a warm container, so a
+# log file seen again by an overlapping window is not downloaded and parsed twice.
+# Entries are validated by the log file's ETag and the least recently used are evicted when the
+# estimated size goes over LOG_CACHE_MB.
+log_cache_budget = int(os.getenv('LOG_CACHE_MB', '64')) * 1024 * 1024
+
+# (log_bucket, log_key) -> (etag, events, estimated size)
+_entries = OrderedDict()
+_cached_bytes = 0
+_lock = threading.Lock()
+
+stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def estimate_size(events):
+    # events are tuples of short strings and ints, about 100 bytes of overhead per event
+    return 64 + sum(100 + sum(len(field) for field in event if isinstance(field, str)) for event in events)
+
+
+def get(log_bucket, log_key, etag):
+    # Cached events of the log file, None when it is not cached or has changed since
+    with _lock:
+        entry = _entries.get((log_bucket, log_key))
+        if entry is None or not etag or entry[0] != etag:
+            stats['misses'] += 1
+            return None
+        _entries.move_to_end((log_bucket, log_key))
+        stats['hits'] += 1
+        return entry[1]
+
+
+def put(log_bucket, log_key, etag, events, size=None):
+    # size overrides estimate_size for events which are not a list of tuples (SAL upload columns)
+    global _cached_bytes
+    if not etag:
+        return
+    if size is None:
+        size = estimate_size(events)
+    if size > log_cache_budget:
+        return
+
+    with _lock:
+        previous = _entries.pop((log_bucket, log_key), None)
+        if previous is not None:
+            _cached_bytes -= previous[2]
+        _entries[(log_bucket, log_key)] = (etag, events, size)
+        _cached_bytes += size
+
+        while _cached_bytes > log_cache_budget:
+            _, (_, _, evicted_size) = _entries.popitem(last=False)
+            _cached_bytes -= evicted_size
+            stats['evictions'] += 1
+
+
+def reset_stats():
+    with _lock:
+        for name in stats:
+            stats[name] = 0
+
+
+def summary_text():
+    lookups = stats['hits'] + stats['misses']
+    hit_rate = stats['hits'] / lookups * 100 if lookups else 0
+    return (f"Log cache: {stats['hits']} hits, {stats['misses']} misses ({hit_rate:.1f}% hit rate), "
+            f"{stats['evictions']} evictions, {len(_entries)} log files / {_cached_bytes / 1024 / 1024:.1f} MB cached")
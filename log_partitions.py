@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+s3_client = boto3.client('s3')
+
+# Number of log partitions scanned at the same time
+max_scan_workers = int(os.getenv('LOG_SCAN_WORKERS', '8'))
+
+# bucket01=111122223333,bucket02=444455556666 (optional, buckets without an entry route to every account)
+bucket_accounts = dict(
+    entry.split('=') for entry in os.getenv('BUCKET_ACCOUNTS', '').split(',') if entry
+)
+
+_bucket_regions = {}
+
+
+def parse_log_partitions(value):
+    # value format = account01:region01,account02:region02:log_bucket02
+    # the optional third field is the log bucket of that partition (used by Server Access Logs)
+    partitions = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        # the log bucket may be a local folder (file:///path), so only the first two ':' separate fields
+        fields = entry.split(':', 2)
+        account, region = fields[0], fields[1]
+        log_bucket = fields[2] if len(fields) > 2 else None
+        partitions.append((account, region, log_bucket))
+    return partitions
+
+
+def cloudtrail_prefix(account, region, organization_id=None):
+    # Organization trails add the organization id in front of the account
+    if organization_id:
+        return f"AWSLogs/{organization_id}/{account}/CloudTrail/{region}/"
+    return f"AWSLogs/{account}/CloudTrail/{region}/"
+
+
+def get_bucket_region(bucket_name):
+    if bucket_name not in _bucket_regions:
+        try:
+            location = s3_client.get_bucket_location(Bucket=bucket_name).get('LocationConstraint')
+            # us-east-1 buckets return an empty location
+            _bucket_regions[bucket_name] = location or 'us-east-1'
+        except (BotoCoreError, ClientError) as e:
+            print(f"Unable to get region of bucket {bucket_name}, scanning every region : error : {e}")
+            _bucket_regions[bucket_name] = None
+    return _bucket_regions[bucket_name]
+
+
+def route_buckets(partitions, nfl_bucket_names):
+    # Assign every monitored bucket to the partitions that can hold its logs,
+    # partitions without monitored buckets are dropped
+    routes = {partition: [] for partition in partitions}
+    for nfl_bucket_name in sorted(set(nfl_bucket_names)):
+        region = get_bucket_region(nfl_bucket_name)
+        account = bucket_accounts.get(nfl_bucket_name)
+        for partition in partitions:
+            partition_account, partition_region, _ = partition
+            if region and partition_region != region:
+                continue
+            if account and partition_account != account:
+                continue
+            routes[partition].append(nfl_bucket_name)
+
+    return {partition: buckets for partition, buckets in routes.items() if buckets}
+
+
+def scan_partitions(routes, scan_partition):
+    # Run scan_partition(partition, bucket_names) for every routed partition in parallel,
+    # results are returned in the same order as the partitions were configured
+    results = []
+    if not routes:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(max_scan_workers, len(routes))) as executor:
+        futures = [(partition, executor.submit(scan_partition, partition, buckets)) for partition, buckets in routes.items()]
+        for partition, future in futures:
+            try:
+                results.append((partition, future.result()))
+            except ClientError as e:
+                print(f"An error occurred while scanning log partition {partition[0]}/{partition[1]} : error : {e}")
+
+    return results
@@ -0,0 +1,168 @@
+import hashlib
+import mmap
+import os
+import threading
+from datetime import datetime, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+
+s3_client = boto3.client('s3')
+
+# A log bucket is either an S3 bucket name or a local directory written as file:///path/to/logs,
+# holding the log files under the same keys as in S3 (for example a folder synced with `aws s3 sync`,
+# which keeps LastModified as the file modification time).
+LOCAL_SCHEME = 'file://'
+
+
+# Log objects downloaded from S3 are kept in /tmp between invocations of a warm container, named
+# <digest of bucket/key>.<ETag>. A repeat read costs nothing when the listing's ETag matches, and a
+# conditional GET answered with 304 Not Modified otherwise. 0 MB disables the cache.
+disk_cache_dir = os.getenv('LOG_DISK_CACHE_DIR', '/tmp/nfl_log_cache')
+disk_cache_budget = int(os.getenv('LOG_DISK_CACHE_MB', '256')) * 1024 * 1024
+
+# key digest -> (etag, size) of the cached files, read from disk_cache_dir on first use
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+
+def is_local_source(log_bucket):
+    return log_bucket.startswith(LOCAL_SCHEME)
+
+
+def _local_path(log_bucket, log_key=''):
+    return os.path.join(log_bucket[len(LOCAL_SCHEME):], *log_key.split('/'))
+
+
+def list_logs(log_bucket, prefix, start_after=None):
+    # Yield log files under prefix in key order, shaped like list_objects_v2 'Contents' entries.
+    # Stopping the iteration early also stops the listing.
+    if not is_local_source(log_bucket):
+        paginator = s3_client.get_paginator('list_objects_v2')
+        params = {'Bucket': log_bucket, 'Prefix': prefix}
+        if start_after:
+            params['StartAfter'] = start_after
+        for page in paginator.paginate(**params):
+            yield from page.get('Contents', [])
+        return
+
+    root = _local_path(log_bucket)
+    # prefix may end in the middle of a file name, so the walk starts at its folder
+    keys = []
+    for folder, _, filenames in os.walk(_local_path(log_bucket, prefix.rsplit('/', 1)[0] if '/' in prefix else '')):
+        for filename in filenames:
+            log_key = os.path.relpath(os.path.join(folder, filename), root).replace(os.sep, '/')
+            if log_key.startswith(prefix) and (not start_after or log_key > start_after):
+                keys.append(log_key)
+
+    for log_key in sorted(keys):
+        stat = os.stat(_local_path(log_bucket, log_key))
+        yield {
+            'Key': log_key,
+            'LastModified': datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+            'Size': stat.st_size,
+            # stands in for the ETag, it changes whenever the file is rewritten
+            'ETag': f'"{stat.st_mtime_ns}-{stat.st_size}"'
+        }
+
+
+def _map_file(path):
+    # The result supports slicing like bytes and is a file object for gzip
+    with open(path, 'rb') as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _cache_digest(log_bucket, log_key):
+    return hashlib.blake2b(f"{log_bucket}/{log_key}".encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _cache_path(digest, etag):
+    return os.path.join(disk_cache_dir, digest + '.' + etag.strip('"'))
+
+
+def _load_disk_cache():
+    global _disk_cache
+    if _disk_cache is None:
+        _disk_cache = {}
+        os.makedirs(disk_cache_dir, exist_ok=True)
+        for filename in os.listdir(disk_cache_dir):
+            digest, _, etag = filename.partition('.')
+            if etag and not etag.endswith('.tmp'):
+                _disk_cache[digest] = (f'"{etag}"', os.path.getsize(os.path.join(disk_cache_dir, filename)))
+    return _disk_cache
+
+
+def _store(digest, etag, body):
+    # Write the object next to the others and evict the least recently read files over the budget
+    with _disk_cache_lock:
+        cache = _load_disk_cache()
+        previous = cache.pop(digest, None)
+        if previous is not None:
+            os.remove(_cache_path(digest, previous[0]))
+
+        path = _cache_path(digest, etag)
+        with open(f"{path}.tmp", 'wb') as cache_file:
+            cache_file.write(body)
+        os.replace(f"{path}.tmp", path)
+        cache[digest] = (etag, len(body))
+
+        cached_bytes = sum(size for _, size in cache.values())
+        if cached_bytes <= disk_cache_budget:
+            return
+        by_access = sorted(cache, key=lambda cached: os.path.getmtime(_cache_path(cached, cache[cached][0])))
+        for evicted in by_access:
+            if cached_bytes <= disk_cache_budget or evicted == digest:
+                break
+            evicted_etag, evicted_size = cache.pop(evicted)
+            os.remove(_cache_path(evicted, evicted_etag))
+            cached_bytes -= evicted_size
+
+
+def _read_cached_log(log_bucket, log_key, etag):
+    digest = _cache_digest(log_bucket, log_key)
+    with _disk_cache_lock:
+        cached = _load_disk_cache().get(digest)
+
+    if cached is not None:
+        cached_etag = cached[0]
+        if etag != cached_etag:
+            # the listing did not tell, or the object changed: revalidate the cached copy
+            try:
+                response = s3_client.get_object(Bucket=log_bucket, Key=log_key, IfNoneMatch=cached_etag)
+            except ClientError as e:
+                if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') != 304:
+                    raise
+            else:
+                body = response['Body'].read()
+                _store(digest, response['ETag'], body)
+                return body
+
+        path = _cache_path(digest, cached_etag)
+        # the modification time orders the eviction, a read counts as a use
+        os.utime(path)
+        return _map_file(path)
+
+    response = s3_client.get_object(Bucket=log_bucket, Key=log_key)
+    body = response['Body'].read()
+    if len(body) <= disk_cache_budget:
+        _store(digest, response['ETag'], body)
+    return body
+
+
+def read_log(log_bucket, log_key, etag=None):
+    # Return the raw content of a log file. Local files are memory mapped instead of being read,
+    # the result supports slicing like bytes and is a file object for gzip.
+    # etag is the ETag from the listing, a cached copy with the same ETag is used without any request.
+    if not is_local_source(log_bucket):
+        if disk_cache_budget <= 0:
+            return s3_client.get_object(Bucket=log_bucket, Key=log_key)['Body'].read()
+        try:
+            return _read_cached_log(log_bucket, log_key, etag)
+        except OSError as e:
+            # a full or read only /tmp must not fail the run
+            print(f"Log disk cache unavailable, reading {log_bucket}/{log_key} directly : error : {e}")
+            return s3_client.get_object(Bucket=log_bucket, Key=log_key)['Body'].read()
+
+    return _map_file(_local_path(log_bucket, log_key))
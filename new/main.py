@@ -1,11 +1,23 @@
 import boto3
 from botocore.exceptions import ClientError
 from datetime import datetime, timedelta, timezone
-import json
-import gzip
-import csv
-import io
 import os
+
+# cost_accounting first, it hooks the boto3 session before the other modules create their clients
+import cost_accounting
+import event_index
+import inventory
+import log_cache
+import log_partitions
+import pending_queue
+import prefix_trie
+import profiling
+import report_writer
+import run_context
+import s3_lister
+import seen_set
+import sla_engine
+import snapshot
  
 # Initialize clients for S3 and SNS
 s3_client = boto3.client('s3')
@@ -13,33 +25,35 @@ sns_client = boto3.client('sns')
  
 # CloudTrail related variables
 log_bucket = os.getenv('LOG_BUCKET', 'aws-cloudtrail-logs-dataevent')
-log_prefix = f"AWSLogs/211125347349/CloudTrail/us-east-1/"  # customize logs prefix to scan only today's logs
+# log_partitions = account01:region01,account02:region02.... every partition is scanned as AWSLogs/[organization_id/]account/CloudTrail/region/
+partitions = log_partitions.parse_log_partitions(os.getenv('LOG_PARTITIONS', '211125347349:us-east-1'))
+organization_id = os.getenv('ORGANIZATION_ID')
  
-# bucket_names = bucket01:prefix01,bucket02:prefix....
-bucket_names = os.getenv('BUCKET_NAMES', 'athena-glue-1205:csv/logs/').split(',')
-lambda_time_ran = datetime.utcnow().strftime('%Y-%m-%d_%H:%M:%S')
+# BUCKET_NAMES = bucket01:prefix01,bucket02:prefix.... or the NFL sheet in MONITORED_PREFIXES_FILE
+monitored_prefixes = prefix_trie.load_monitored_prefixes(os.getenv('BUCKET_NAMES', 'athena-glue-1205:csv/logs/'))
+prefix_tries = prefix_trie.build_prefix_tries(monitored_prefixes)
 max_time_interval = int(os.getenv('MAX_TIME_INTERVAL', '3')) # default is 3 hours
 
+# listing = list the NFL buckets and attribute new files from the logs
+# logs    = report the upload events of the logs directly, without listing the NFL buckets
+discovery_mode = os.getenv('DISCOVERY_MODE', 'listing')
+verify_with_head = os.getenv('VERIFY_WITH_HEAD', 'false').lower() == 'true'
+
 # Bucket to store csv output
 output_bucket = os.getenv('OUTPUT_BUCKET')
-output_csv_key = f'nfl/csv/{lambda_time_ran}_file_metadata.csv'
+# reports are written under dt=YYYY-MM-DD/hour=HH/bucket=... partitions, see report_writer
+report_prefix = os.getenv('REPORT_PREFIX', 'nfl/csv/')
 sns_topic_arn = os.getenv('SNS_TOPIC_ARN')
  
-csv_data = [["Bucket_name", "Prefix", "Filename", "Uploader", "Datetime_file_landed", "Datetime_lambda_ran"]]
-current_time_utc = datetime.utcnow().replace(tzinfo=timezone.utc)
+csv_header = ["Bucket_name", "Prefix", "Filename", "Uploader", "Datetime_file_landed", "Datetime_lambda_ran"]
 
 
-def write_csv_to_s3(csv_data, output_bucket, output_csv_key):
-    try:
-        csv_buffer = io.StringIO()
-        writer = csv.writer(csv_buffer)
-        writer.writerows(csv_data)
- 
-        s3_client.put_object(Bucket=output_bucket, Key=output_csv_key, Body=csv_buffer.getvalue())
-        print(f"CSV file uploaded to {output_bucket}/{output_csv_key}")
- 
-    except ClientError as e:
-        print(f"Error uploading CSV to S3: {e}")
+def write_csv_to_s3(run, output_bucket, report_prefix):
+    report_writer.write_report(
+        output_bucket, report_prefix, run['lambda_time_ran'], run['csv_data'][0], run['csv_data'][1:],
+        [bucket_name for bucket_name, _ in monitored_prefixes],
+        metadata=cost_accounting.summary_metadata(), fallback_time=run['current_time_utc']
+    )
  
 def send_notification(sns_topic_arn, body):
     try:
@@ -53,123 +67,248 @@ def send_notification(sns_topic_arn, body):
         print(f"Error sending metadata notification: {e}")
 
 
-def fetch_logs(file_key, bucket_name):
-    # Timezone in S3 bucket event is recorded as UTC, however, in cloud trail its in UTC-4 
-    # Hence, we are checking for S3 object put event under Today, Tomorrow and Yesterday's log.
-    # 0 - Today, 1 - Tomorrow, -1 - Yesterday
-    days_offset = [0, -1, 1]
-    
-    # Prepare log prefixes for today, yesterday, and tomorrow
-    dynamic_log_prefixes = [
-        f"{log_prefix}{(current_time_utc + timedelta(days=offset)).strftime('%Y/%m/%d')}" 
-        for offset in days_offset
-    ]
-
-    # Check logs files for each day from dynamic_log_prefixes list
-    for each_prefix in dynamic_log_prefixes:
-        print(each_prefix)
-        response = s3_client.list_objects_v2(Bucket=log_bucket, Prefix=each_prefix)
-        print("response generated")
-
-        logs = response.get('Contents', [])
-
-        if not logs:
-            print(f"No logs found in the bucket {log_bucket}/{each_prefix}.")
+def build_upload_index(upload_times, current_time_utc, time_ranges=None, delivered_after=None):
+    # Route every NFL bucket to the (account, region) log partitions which can hold its events
+    # and scan the routed partitions in parallel.
+    # upload_times maps bucket -> its new objects, only the CloudTrail files delivered around their
+    # LastModified are read (up to now for multipart uploads). A bucket mapped to None needs every file of the time window.
+    # time_ranges and delivered_after override the ranges of every partition (see recheck_pending).
+    routes = log_partitions.route_buckets(partitions, list(upload_times))
+
+    def scan_partition(partition, routed_buckets):
+        account, region, _ = partition
+        partition_prefix = log_partitions.cloudtrail_prefix(account, region, organization_id)
+
+        partition_ranges = time_ranges
+        if partition_ranges is None and all(upload_times[routed_bucket] is not None for routed_bucket in routed_buckets):
+            new_objects = [obj for routed_bucket in routed_buckets for obj in upload_times[routed_bucket]]
+            partition_ranges = event_index.upload_time_ranges(
+                [obj['LastModified'] for obj in new_objects if not event_index.is_multipart(obj.get('ETag'))],
+                [obj['LastModified'] for obj in new_objects if event_index.is_multipart(obj.get('ETag'))],
+                until=current_time_utc
+            )
+            if not partition_ranges:
+                return {}
+
+        print(f"Scanning {log_bucket}/{partition_prefix} for buckets {routed_buckets}")
+        return event_index.scan_cloudtrail_prefix(
+            log_bucket, partition_prefix, {routed_bucket: prefix_tries[routed_bucket] for routed_bucket in routed_buckets},
+            current_time_utc, max_time_interval,
+            time_ranges=partition_ranges, partition=(account, region), delivered_after=delivered_after
+        )
+
+    upload_index = {}
+    for partition, partition_index in log_partitions.scan_partitions(routes, scan_partition):
+        event_index.merge_indexes(upload_index, partition_index)
+    return upload_index
+
+
+def fetch_logs(file_key, bucket_name, last_modified_time, upload_index, multipart=False):
+    # Attribute the upload event closest to the object's LastModified
+    username = event_index.lookup_uploader(upload_index, bucket_name, file_key, last_modified_time, multipart)
+    if username is None:
+        print(f"No upload entries found in logs for the object: {bucket_name}/{file_key} aborting ...")
+    return username
+
+
+def report_file(run, bucket_name, file_key, uploader, last_modified_time):
+    file_metadata = {
+        "Prefix": os.path.dirname(file_key),
+        "Filename": os.path.basename(file_key),
+        "Uploader": uploader, 
+        "Datetime_file_landed": last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'),
+        "Datetime_lambda_ran": run['lambda_time_ran']
+    }
+    # send_notification(sns_topic_arn, body=f"NFL S3 file processing using Lambda Function for the bucket {bucket_name} \n\nMetadata: \n{file_metadata}")
+    print(f"NFL S3 file processing using Lambda Function for the bucket {bucket_name} \n\nMetadata: \n{file_metadata}")
+    run['csv_data'].append([bucket_name, file_metadata["Prefix"], file_metadata["Filename"], file_metadata["Uploader"], file_metadata["Datetime_file_landed"], file_metadata["Datetime_lambda_ran"]])
+
+
+def recheck_pending(run, upload_index):
+    # Files of earlier runs without an uploader are looked up in this run's index first, the rest only in the
+    # CloudTrail files delivered since they were last searched. Resolved files are reported by this run.
+    current_time_utc = run['current_time_utc']
+    entries = [entry for entry in pending_queue.pending_uploads() if entry['bucket'] in prefix_tries]
+    if not entries:
+        return
+
+    unresolved = []
+    for entry in entries:
+        uploader = event_index.lookup_uploader(upload_index, entry['bucket'], entry['key'], pending_queue.last_modified_time(entry), entry.get('multipart', False))
+        if uploader is None:
+            unresolved.append(entry)
+        else:
+            pending_queue.resolve_pending(entry)
+            report_file(run, entry['bucket'], entry['key'], uploader, pending_queue.last_modified_time(entry))
+
+    if not unresolved:
+        return
+
+    searched_until = pending_queue.oldest_search(unresolved)
+    # late files hold events up to the delivery delay before their key time
+    range_start = max(
+        min(pending_queue.last_modified_time(entry) for entry in unresolved) - timedelta(minutes=event_index.event_lead_time),
+        searched_until - timedelta(minutes=event_index.cloudtrail_delivery_delay)
+    )
+    print(f"Re-checking {len(unresolved)} files without uploader in the logs delivered after {searched_until}")
+    pending_index = build_upload_index(
+        {entry['bucket']: [] for entry in unresolved}, current_time_utc,
+        time_ranges=[[range_start, current_time_utc]], delivered_after=searched_until
+    )
+
+    for entry in unresolved:
+        uploader = event_index.lookup_uploader(pending_index, entry['bucket'], entry['key'], pending_queue.last_modified_time(entry), entry.get('multipart', False))
+        if uploader is None:
+            pending_queue.mark_searched(entry, current_time_utc)
+        else:
+            pending_queue.resolve_pending(entry)
+            report_file(run, entry['bucket'], entry['key'], uploader, pending_queue.last_modified_time(entry))
+
+
+def discover_from_logs(run):
+    # The upload events already tell which files landed, by whom and when, so the monitored
+    # buckets are never listed. Every bucket needs the whole time window of CloudTrail files.
+    upload_index = build_upload_index({bucket_name: None for bucket_name, _ in monitored_prefixes}, run['current_time_utc'])
+    window_start = (run['current_time_utc'] - timedelta(hours=max_time_interval)).timestamp()
+    recent_prefixes = set()
+
+    for bucket_name, file_key in sorted(upload_index):
+        # skip folder objects
+        if not os.path.basename(file_key):
             continue
 
-        # Iterate through each log
-        print("for log running")
-        for log in logs:
-            print(log)
-            last_modified_time_logs = log['LastModified']
-            print(last_modified_time_logs)
-            
-            # Continue only if the log is within the 'max_time_interval'
-            #  current - 8:10 pm - 8:09 = 1 > 
-            if current_time_utc - last_modified_time_logs > timedelta(hours=max_time_interval):
+        times, usernames = upload_index[(bucket_name, file_key)]
+        if times[-1] < window_start:
+            continue
+        # with overlapping prefixes the file is recent for every prefix holding it
+        recent_prefixes_of_file = [(bucket_name, prefix) for prefix in prefix_trie.match_prefixes(prefix_tries, bucket_name, file_key)]
+
+        # overlapping windows see the same upload event again, it is only reported once
+        new_events = [
+            (epoch, username) for epoch, username in zip(times, usernames)
+            if epoch >= window_start and not seen_set.is_seen(bucket_name, file_key, str(epoch))
+        ]
+        if not new_events:
+            recent_prefixes.update(recent_prefixes_of_file)
+            continue
+
+        if verify_with_head:
+            # drop files which were deleted after they were uploaded, only files with a new event are HEADed
+            try:
+                s3_client.head_object(Bucket=bucket_name, Key=file_key)
+            except ClientError as e:
+                print(f"Skipping {bucket_name}/{file_key}, it no longer exists : error : {e}")
                 continue
-            
-            print(f"file {log}, difference is == {timedelta}")
-            
-            log_key = log['Key']
-            log_obj = s3_client.get_object(Bucket=log_bucket, Key=log_key)
-            log_content = log_obj['Body'].read()
-
-            # Decompress gzipped formatted logs 
-            with gzip.GzipFile(fileobj=io.BytesIO(log_content)) as log_file:
-                log_lines = [line.decode('utf-8') for line in log_file]
-
-            # Check each log line for the upload event
-            for line in log_lines:
-                try:
-                    event_data = json.loads(line)
-                    for record in event_data.get('Records', []):
-                        if record.get('eventName') == 'PutObject':
-                            request_params = record.get('requestParameters', {})
-                            if request_params.get('bucketName') == bucket_name and request_params.get('key') == file_key:
-                                username = record.get('userIdentity', {}).get('arn', 'Unknown').split('/')[-1]
-                                return username
-                except json.JSONDecodeError as e:
-                    print(f"Skipping invalid JSON line in file: {log_key} : error : {e}")
-            print("for log running under loop")
-
-        print("for log running over loop")        
-
-    print(f"No PutObject entries found in logs for the object: {bucket_name}/{file_key} aborting ...")
-
-
-
-def main():
-    for nfl_bucket in bucket_names:
-        bucket_name, prefix = nfl_bucket.split(':')
+
+        for epoch, username in new_events:
+            seen_set.mark_seen(bucket_name, file_key, str(epoch))
+            report_file(run, bucket_name, file_key, username, datetime.fromtimestamp(epoch, tz=timezone.utc))
+            sla_engine.record_arrival(bucket_name, file_key, datetime.fromtimestamp(epoch, tz=timezone.utc))
+        recent_prefixes.update(recent_prefixes_of_file)
+
+    for bucket_name, prefix in monitored_prefixes:
+        if (bucket_name, prefix) in recent_prefixes:
+            print(f"Recent files have been uploaded to bucket: {bucket_name}/{prefix}.")
+        else:
+            print(f"No recent files have been uploaded to bucket: {bucket_name}/{prefix}.")
+
+
+def main(run):
+    current_time_utc = run['current_time_utc']
+    if discovery_mode == 'logs':
+        discover_from_logs(run)
+        seen_set.save_seen_set()
+        return
+
+    # List the NFL buckets first, the LastModified of their new files tells which CloudTrail files have to be read
+    upload_times = {}
+    listed_locations = []
+    for bucket_name, prefix in monitored_prefixes:
+        # Inventory buckets are read after the CloudTrail scan, which also finds the files uploaded after the inventory
+        if bucket_name in inventory.inventory_sources:
+            upload_times[bucket_name] = None
+        else:
+            listed_locations.append((bucket_name, prefix))
+
+    # New or changed objects since the previous run's snapshot of every bucket/prefix, listed in parallel.
+    # A ClientError is kept in place of the listing and reported with its bucket below.
+    listings = dict(s3_lister.list_locations(
+        listed_locations,
+        lambda bucket_name, prefix: snapshot.find_new_objects(bucket_name, prefix, current_time_utc, max_time_interval)
+    ))
+    for (bucket_name, prefix), listing in listings.items():
+        if not isinstance(listing, ClientError):
+            upload_times.setdefault(bucket_name, []).extend(listing[0])
+
+    # Scan the CloudTrail logs once for every NFL bucket
+    upload_index = build_upload_index(upload_times, current_time_utc)
+    recheck_pending(run, upload_index)
+
+    for bucket_name, prefix in monitored_prefixes:
         try:
-            # List objects in the bucket as per given prefix
-            response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
+            listing = listings.get((bucket_name, prefix))
+            if isinstance(listing, ClientError):
+                raise listing
+
+            new_objects, snapshot_entries = listing or (None, None)
+
+            # Huge buckets are read from their S3 Inventory instead of being listed
+            if bucket_name in inventory.inventory_sources:
+                new_objects = inventory.list_window_objects(bucket_name, prefix, current_time_utc, max_time_interval, upload_index)
+                if new_objects is None:
+                    new_objects, snapshot_entries = snapshot.find_new_objects(bucket_name, prefix, current_time_utc, max_time_interval)
  
-            if 'Contents' not in response:
+            if not new_objects and not snapshot_entries:
                 # send_notification(sns_topic_arn, body=f"No files found in bucket: {bucket_name} with prefix: {prefix}.")
                 print(f"No files found in bucket: {bucket_name} with prefix: {prefix}.")
                 continue
  
  
-            # Flag to determine if any file have been modified in given time interval
+            # Flag to determine if any file have been modified since the last run
             recent_files_found = False
  
-            for obj in response['Contents']:
+            for obj in new_objects:
                 # absolute path (full path) of a selected file
                 file_key = obj['Key']
                 last_modified_time = obj['LastModified']
-                key_prefix = os.path.dirname(file_key)
                 filename = os.path.basename(file_key)
  
                 # skip if response returns empty folder as object
                 if not filename:
                     continue  
+
+                # recent_files_found defaults to False, if any file is modified it will return
+                # true outside of loop
+                recent_files_found = True
+                sla_engine.record_arrival(bucket_name, file_key, last_modified_time)
+
+                # with overlapping prefixes a file still counts as recent for every prefix listing it,
+                # but it is only reported and attributed under its longest monitored prefix
+                if prefix_trie.match_prefix(prefix_tries, bucket_name, file_key) != prefix:
+                    continue
+
+                # Inventory objects are not diffed against a snapshot, every run sees the whole window again,
+                # so files already reported (or queued) by an earlier run are skipped with the seen set
+                if snapshot_entries is None:
+                    if seen_set.is_seen(bucket_name, file_key, obj['ETag']):
+                        continue
+                    seen_set.mark_seen(bucket_name, file_key, obj['ETag'])
  
-                # Check if the file was uploaded within the given time interval
-                if current_time_utc - last_modified_time <= timedelta(hours=max_time_interval):
- 
-                    # recent_files_found defaults to False, if any file is modified it will return
-                    # true outside of loop
-                    recent_files_found = True
- 
-                    # Get file/object uploader name
-                    uploader=fetch_logs(file_key, bucket_name)
+                # Get file/object uploader name
+                multipart = event_index.is_multipart(obj.get('ETag'))
+                uploader=fetch_logs(file_key, bucket_name, last_modified_time, upload_index, multipart)
  
-                    # Skipping because logs are not generated and uploader is empty
-                    if uploader is None:
-                        continue
+                # Logs are not delivered yet, the file is queued and reported once a later run finds its uploader.
+                # This run only read the CloudTrail files keyed up to the delivery delay after LastModified
+                # (up to now for multipart uploads, see event_index.upload_time_ranges), later files are read by the recheck.
+                if uploader is None:
+                    searched_until = current_time_utc
+                    if not multipart:
+                        searched_until = min(current_time_utc, last_modified_time + timedelta(minutes=event_index.cloudtrail_delivery_delay))
+                    pending_queue.add_pending(bucket_name, file_key, last_modified_time, None, searched_until, multipart)
+                    continue
  
-                    file_metadata = {
-                        "Prefix": key_prefix,
-                        "Filename": filename,
-                        "Uploader": uploader, 
-                        "Datetime_file_landed": last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'),
-                        "Datetime_lambda_ran": lambda_time_ran
-                    }
-                    # send_notification(sns_topic_arn, body=f"NFL S3 file processing using Lambda Function for the bucket {bucket_name} \n\nMetadata: \n{file_metadata}")
-                    print(f"NFL S3 file processing using Lambda Function for the bucket {bucket_name} \n\nMetadata: \n{file_metadata}")
-                    csv_data.append([bucket_name, file_metadata["Prefix"], file_metadata["Filename"], file_metadata["Uploader"], file_metadata["Datetime_file_landed"], file_metadata["Datetime_lambda_ran"]])
+                report_file(run, bucket_name, file_key, uploader, last_modified_time)
 
  
             if recent_files_found:
@@ -178,13 +317,37 @@ def main():
                 print("write to csv call")
             else:
                 print(f"No recent files have been uploaded to bucket: {bucket_name}/{prefix}.")
+
+            # Store the snapshot only after every new file is processed, so a failed run reports them again
+            if snapshot_entries is not None:
+                snapshot.save_snapshot(bucket_name, prefix, snapshot_entries)
  
         except ClientError as e:
             print(e)
             # send_notification(sns_topic_arn, body=f"An error occurred while processing bucket: {bucket_name}/{prefix} \n\nError: {str(e)}")
             print(f"An error occurred while processing bucket: {bucket_name}/{prefix} \n\nError: {str(e)}")
+
+    seen_set.save_seen_set()
+    pending_queue.save_pending()
  
-def lambdaf():
-    main()
+def check_sla(run):
+    # Alert once for every expected arrival whose grace period ended without a file
+    alerts = sla_engine.check_deadlines(run['current_time_utc'])
+    if alerts:
+        send_notification(sns_topic_arn, body="Expected NFL files are missing:\n\n" + "\n".join(alerts))
+    sla_engine.save_sla_state()
+
+@profiling.profiled
+def lambdaf(event=None, context=None):
+    # event and context are passed by Lambda, {"profile": true} in the event turns on profiling (see profiling.py).
+    # The call at the end of this file runs it without an event.
+    # every invocation starts from a new run context, a warm container only keeps clients and caches
+    run = run_context.new_run(csv_header)
+    cost_accounting.reset()
+    log_cache.reset_stats()
+    main(run)
+    check_sla(run)
+    print(log_cache.summary_text())
+    print(cost_accounting.summary_text())
 
 lambdaf()
@@ -1,34 +1,13 @@
 import boto3
 
+import s3_lister
+
 s3_client = boto3.client('s3')
 
 
 def list_all_objects(bucketname, prefix):
-    objects = []
-    continuation_token = None
-
-    while True:
-        if continuation_token:
-            response = s3_client.list_objects_v2(
-                Bucket=bucketname,
-                Prefix=prefix,
-                ContinuationToken=continuation_token
-            )
-        else:
-            response = s3_client.list_objects_v2(
-                Bucket=bucketname,
-                Prefix=prefix
-            )
-
-        if 'Contents' in response:
-            objects.extend(response['Contents'])
-        
-        if response.get('IsTruncated'):  # Check if there are more objects
-            continuation_token = response['NextContinuationToken']
-        else:
-            break
-
-    return objects
+    # Sub-prefixes are discovered first and listed concurrently, see s3_lister.walk_prefix
+    return s3_lister.walk_prefix(bucketname, prefix, client=s3_client)
 
 
 bucketname = "athena-glue-1205"
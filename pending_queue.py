@@ -0,0 +1,126 @@
+import csv
+import io
+import os
+import time
+from datetime import datetime, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+
+import state_store
+
+s3_client = boto3.client('s3')
+
+# Files whose uploader was not found in the logs yet: s3://bucket/key, or a local path as a stand-in
+pending_queue_location = os.getenv('PENDING_QUEUE_LOCATION', '/tmp/nfl_pending_uploads.json.gz')
+# Files still unresolved after this many hours are dropped, their report keeps "Logs not uploaded yet"
+pending_max_age_hours = int(os.getenv('PENDING_MAX_AGE_HOURS', '72'))
+
+UNRESOLVED_UPLOADER = "Logs not uploaded yet"
+
+# bucket \0 key \0 LastModified epoch -> entry, see add_pending
+pending = {}
+_loaded = False
+
+
+def _entry_id(bucket_name, file_key, last_modified):
+    return f"{bucket_name}\0{file_key}\0{last_modified}"
+
+
+def load_pending():
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+
+    state = state_store.load_state(pending_queue_location, "pending queue")
+    if state is not None:
+        pending.update(state)
+
+
+def drop_expired():
+    # Applied on every run, a warm container loads the queue only once
+    expires_before = time.time() - pending_max_age_hours * 3600
+    for entry_id, entry in list(pending.items()):
+        if entry['last_modified'] < expires_before:
+            del pending[entry_id]
+            print(f"Giving up on the uploader of {entry['bucket']}/{entry['key']}, no log found in {pending_max_age_hours} hours")
+
+
+def save_pending():
+    if not _loaded:
+        return
+
+    drop_expired()
+    state_store.save_state(pending_queue_location, "pending queue", pending)
+
+
+def add_pending(bucket_name, file_key, last_modified_time, report_key, searched_until, multipart=False):
+    # searched_until: every log file delivered before this time was already searched for the file
+    # multipart: the upload completed after LastModified, see event_index.lookup_uploader
+    load_pending()
+    last_modified = int(last_modified_time.timestamp())
+    pending.setdefault(_entry_id(bucket_name, file_key, last_modified), {
+        'bucket': bucket_name,
+        'key': file_key,
+        'last_modified': last_modified,
+        'report_key': report_key,
+        'searched_until': int(searched_until.timestamp()),
+        'multipart': multipart
+    })
+
+
+def pending_uploads():
+    load_pending()
+    drop_expired()
+    return list(pending.values())
+
+
+def last_modified_time(entry):
+    return datetime.fromtimestamp(entry['last_modified'], tz=timezone.utc)
+
+
+def oldest_search(entries):
+    # Only the log files delivered after this time can hold an uploader not found yet
+    return datetime.fromtimestamp(min(entry['searched_until'] for entry in entries), tz=timezone.utc)
+
+
+def mark_searched(entry, searched_until):
+    entry['searched_until'] = int(searched_until.timestamp())
+
+
+def resolve_pending(entry):
+    pending.pop(_entry_id(entry['bucket'], entry['key'], entry['last_modified']), None)
+
+
+def patch_report(report_bucket, resolved):
+    # Replace "Logs not uploaded yet" by the uploader found later, in the report which listed the file.
+    # resolved is a list of (entry, uploader)
+    by_report = {}
+    for entry, uploader in resolved:
+        if entry['report_key']:
+            landed = last_modified_time(entry).strftime('%Y-%m-%d_%H:%M:%S')
+            location = (entry['bucket'], os.path.dirname(entry['key']), os.path.basename(entry['key']), landed)
+            by_report.setdefault(entry['report_key'], {})[location] = uploader
+
+    for report_key, uploaders in by_report.items():
+        try:
+            response = s3_client.get_object(Bucket=report_bucket, Key=report_key)
+            rows = list(csv.reader(io.StringIO(response['Body'].read().decode('utf-8'))))
+            header = rows[0]
+            columns = [header.index(name) for name in ("Bucket_name", "Prefix", "Filename", "Datetime_file_landed")]
+            uploader_column = header.index("Uploader")
+
+            patched = 0
+            for row in rows[1:]:
+                uploader = uploaders.get(tuple(row[column] for column in columns))
+                if uploader and row[uploader_column] == UNRESOLVED_UPLOADER:
+                    row[uploader_column] = uploader
+                    patched += 1
+
+            csv_buffer = io.StringIO()
+            csv.writer(csv_buffer).writerows(rows)
+            s3_client.put_object(Bucket=report_bucket, Key=report_key, Body=csv_buffer.getvalue(), Metadata=response.get('Metadata', {}))
+            print(f"Patched {patched} uploaders in {report_bucket}/{report_key}")
+        except (ClientError, ValueError, IndexError) as e:
+            print(f"Unable to patch report {report_bucket}/{report_key} : error : {e}")
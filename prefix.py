@@ -7,26 +7,25 @@ import gzip
 import io
 import csv
 
+import run_context
+
 # Initialize clients for S3 and SNS
 s3_client = boto3.client('s3')
 sns_client = boto3.client('sns')
 
 
-year = datetime.now().year
-month = datetime.now().strftime('%m')
-day = datetime.now().strftime('%d')
 log_bucket = "aws-cloudtrail-logs-dataevent"
-log_prefix = f"AWSLogs/211125347349/CloudTrail/us-east-1/{year}/{month}"  # customize logs prefix to scan only today's logs
+# customize logs prefix to scan only this month's logs, the year and month are taken from the run time
+log_prefix_format = "AWSLogs/211125347349/CloudTrail/us-east-1/{year}/{month}"
 
 bucket_names = os.getenv('BUCKET_NAMES', 'athena-glue-1205:csv/logs/').split(',')
-lambda_time = datetime.utcnow().strftime('%Y-%m-%d_%H:%M:%S')
 max_time_interval = int(os.getenv('MAX_TIME_INTERVAL', '3'))
 
 output_bucket = os.getenv('OUTPUT_BUCKET', 'rtlab-petclinic-logstore-s3')
-output_csv_key = f'csv/nfl/logs/{lambda_time}_file_metadata.csv'
+output_csv_key_format = 'csv/nfl/logs/{lambda_time_ran}_file_metadata.csv'
 sns_topic_arn = os.getenv('SNS_TOPIC_ARN')
 
-csv_data = [["Bucket_name", "Prefix", "Filename", "Uploader", "Datetime_file_landed", "Datetime_lambda_ran"]]
+csv_header = ["Bucket_name", "Prefix", "Filename", "Uploader", "Datetime_file_landed", "Datetime_lambda_ran"]
 
 def write_csv_to_s3(csv_data, output_bucket, output_csv_key):
     try:
@@ -119,58 +118,67 @@ def fetch_logs(log_bucket, log_prefix, file_key, bucket_name):
 
     print(f"No PutObject entries found for the object: {file_key} - {bucket_name}")
 
-# athena-glue-1205:csv/logs/,rtlab-petclinic-logstore-s3:csv/nfl/logs/
-
-
+def main(run):
+    current_time_utc = run['current_time_utc']
+    log_prefix = log_prefix_format.format(year=current_time_utc.year, month=current_time_utc.strftime('%m'))
 
-for nfl_bucket in bucket_names:
-    bucket_name, prefix = nfl_bucket.split(':')
-    try:
-        # List objects in the bucket
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
+    # athena-glue-1205:csv/logs/,rtlab-petclinic-logstore-s3:csv/nfl/logs/
+    for nfl_bucket in bucket_names:
+        bucket_name, prefix = nfl_bucket.split(':')
+        try:
+            # List objects in the bucket
+            response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
         
-        # Check if there are any files in the bucket
-        if 'Contents' not in response:
-            # send_alert(sns_topic_arn, f"No files found in bucket: {bucket_name} with {prefix}.")
-            print(f"No files found in bucket: {bucket_name} with {prefix}.")
-            continue
-
-        now = datetime.utcnow().replace(tzinfo=timezone.utc)
-        recent_files_found = False
-
-        for obj in response['Contents']:
-            file_key = obj['Key']
-            last_modified_time = obj['LastModified']
-
-            if file_key == prefix:
+            # Check if there are any files in the bucket
+            if 'Contents' not in response:
+                # send_alert(sns_topic_arn, f"No files found in bucket: {bucket_name} with {prefix}.")
+                print(f"No files found in bucket: {bucket_name} with {prefix}.")
                 continue
-            
-            print(file_key)
-
-            # Check if the file was uploaded within the expected time interval
-            if now - last_modified_time <= timedelta(hours=max_time_interval):
-                recent_files_found = True
-                uploader=fetch_logs(log_bucket, log_prefix, file_key, bucket_name)
-                file_metadata = {
-                    "Prefix": prefix,
-                    "Filename": file_key.split('/')[-1],
-                    "Uploader": uploader, 
-                    "Datetime_file_landed": last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'),
-                    "Datetime_lambda_ran": lambda_time
-                }
-
-                # send_metadata_notification(sns_topic_arn, file_metadata)
-                print(file_metadata)
-                csv_data.append([bucket_name, file_metadata["Prefix"], file_metadata["Filename"], file_metadata["Uploader"], file_metadata["Datetime_file_landed"], file_metadata["Datetime_lambda_ran"]])
-
-        if not recent_files_found:
-            # send_alert(sns_topic_arn, f"No recent files have been uploaded to bucket: {bucket_name} with {prefix}.")
-            print(f"No recent files have been uploaded to bucket: {bucket_name} with {prefix}.")
 
-    except ClientError as e:
-        print(e)
-        # send_alert(sns_topic_arn, f"An error occurred in bucket {bucket_name} with {prefix}: {str(e)}")
-        print(f"An error occurred in bucket {bucket_name} with {prefix}: {str(e)}")
+            now = run['current_time_utc']
+            recent_files_found = False
 
-write_csv_to_s3(csv_data, output_bucket, output_csv_key)
+            for obj in response['Contents']:
+                file_key = obj['Key']
+                last_modified_time = obj['LastModified']
 
+                if file_key == prefix:
+                    continue
+            
+                print(file_key)
+
+                # Check if the file was uploaded within the expected time interval
+                if now - last_modified_time <= timedelta(hours=max_time_interval):
+                    recent_files_found = True
+                    uploader=fetch_logs(log_bucket, log_prefix, file_key, bucket_name)
+                    file_metadata = {
+                        "Prefix": prefix,
+                        "Filename": file_key.split('/')[-1],
+                        "Uploader": uploader, 
+                        "Datetime_file_landed": last_modified_time.strftime('%Y-%m-%d_%H:%M:%S'),
+                        "Datetime_lambda_ran": run['lambda_time_ran']
+                    }
+
+                    # send_metadata_notification(sns_topic_arn, file_metadata)
+                    print(file_metadata)
+                    run['csv_data'].append([bucket_name, file_metadata["Prefix"], file_metadata["Filename"], file_metadata["Uploader"], file_metadata["Datetime_file_landed"], file_metadata["Datetime_lambda_ran"]])
+
+            if not recent_files_found:
+                # send_alert(sns_topic_arn, f"No recent files have been uploaded to bucket: {bucket_name} with {prefix}.")
+                print(f"No recent files have been uploaded to bucket: {bucket_name} with {prefix}.")
+
+        except ClientError as e:
+            print(e)
+            # send_alert(sns_topic_arn, f"An error occurred in bucket {bucket_name} with {prefix}: {str(e)}")
+            print(f"An error occurred in bucket {bucket_name} with {prefix}: {str(e)}")
+
+
+def lambda_handler(event, context):
+    # every invocation starts from a new run context, a warm container only keeps its clients
+    run = run_context.new_run(csv_header, output_csv_key_format)
+    main(run)
+    write_csv_to_s3(run['csv_data'], output_bucket, run['output_csv_key'])
+
+
+if __name__ == '__main__':
+    lambda_handler(None, None)
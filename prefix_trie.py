@@ -0,0 +1,99 @@
+import csv
+import io
+import os
+
+import boto3
+
+s3_client = boto3.client('s3')
+
+# Monitored locations come from the NFL sheet exported as CSV (local path or s3://bucket/key, with
+# Bucket and Prefix columns) when MONITORED_PREFIXES_FILE is set, otherwise from BUCKET_NAMES
+# in this format bucket01:prefix01,bucket02:prefix02....
+monitored_prefixes_file = os.getenv('MONITORED_PREFIXES_FILE')
+
+# marks the node where a monitored prefix ends, the value is the prefix itself
+END = None
+
+
+def parse_bucket_names(value):
+    entries = []
+    for nfl_bucket in value.split(','):
+        nfl_bucket = nfl_bucket.strip()
+        if nfl_bucket:
+            bucket_name, _, prefix = nfl_bucket.partition(':')
+            entries.append((bucket_name, prefix))
+    return entries
+
+
+def read_prefixes_file(path):
+    if path.startswith('s3://'):
+        sheet_bucket, sheet_key = path[5:].split('/', 1)
+        body = s3_client.get_object(Bucket=sheet_bucket, Key=sheet_key)['Body'].read().decode('utf-8-sig')
+    else:
+        with open(path, encoding='utf-8-sig') as sheet_file:
+            body = sheet_file.read()
+
+    entries = []
+    for row in csv.DictReader(io.StringIO(body)):
+        row = {name.strip().lower(): (value or '').strip() for name, value in row.items() if name}
+        if row.get('bucket'):
+            entries.append((row['bucket'], row.get('prefix', '')))
+    return entries
+
+
+def load_monitored_prefixes(bucket_names_value=None):
+    # Return the monitored (bucket, prefix) entries in the order they were configured, without duplicates
+    if monitored_prefixes_file:
+        entries = read_prefixes_file(monitored_prefixes_file)
+    else:
+        entries = parse_bucket_names(bucket_names_value or os.getenv('BUCKET_NAMES', ''))
+    return list(dict.fromkeys(entries))
+
+
+def build_prefix_tries(entries):
+    # One character trie per bucket, so a lookup costs the length of the key whatever
+    # the number of monitored prefixes
+    tries = {}
+    for bucket_name, prefix in entries:
+        node = tries.setdefault(bucket_name, {})
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[END] = prefix
+    return tries
+
+
+def match_prefix(tries, bucket_name, file_key):
+    # Longest monitored prefix of file_key in bucket_name, None when the key is not monitored.
+    # With overlapping prefixes (csv/ and csv/logs/) the most specific one always wins.
+    node = tries.get(bucket_name)
+    if node is None or file_key is None:
+        return None
+
+    matched = node.get(END)
+    for char in file_key:
+        node = node.get(char)
+        if node is None:
+            break
+        if END in node:
+            matched = node[END]
+    return matched
+
+
+def match_prefixes(tries, bucket_name, file_key):
+    # Every monitored prefix of file_key in bucket_name, from the shortest to the longest
+    node = tries.get(bucket_name)
+    if node is None or file_key is None:
+        return []
+
+    matched = [node[END]] if END in node else []
+    for char in file_key:
+        node = node.get(char)
+        if node is None:
+            break
+        if END in node:
+            matched.append(node[END])
+    return matched
+
+
+def is_monitored(tries, bucket_name, file_key):
+    return match_prefix(tries, bucket_name, file_key) is not None
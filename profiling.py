@@ -0,0 +1,80 @@
+import cProfile
+import functools
+import io
+import marshal
+import os
+import pstats
+import tracemalloc
+from datetime import datetime
+
+import boto3
+from botocore.exceptions import ClientError
+
+s3_client = boto3.client('s3')
+
+# Profiling is switched on with PROFILE=true or with "profile": true in the invocation event,
+# results are uploaded under PROFILE_LOCATION (s3://bucket/prefix/)
+profile_enabled = os.getenv('PROFILE', 'false').lower() == 'true'
+profile_location = os.getenv('PROFILE_LOCATION', '')
+# Number of allocation sites kept in the memory report
+top_allocations = int(os.getenv('PROFILE_TOP_ALLOCATIONS', '25'))
+
+
+def _is_requested(args):
+    if profile_enabled:
+        return True
+    event = args[0] if args else None
+    return isinstance(event, dict) and bool(event.get('profile'))
+
+
+def _upload(name, body):
+    if not profile_location.startswith('s3://'):
+        print(f"PROFILE_LOCATION is not set, {name} is not uploaded")
+        return
+    bucket, _, prefix = profile_location[len('s3://'):].partition('/')
+    try:
+        s3_client.put_object(Bucket=bucket, Key=f"{prefix}{name}", Body=body)
+        print(f"Profile uploaded to {bucket}/{prefix}{name}")
+    except ClientError as e:
+        print(f"Error uploading profile to S3: {e}")
+
+
+def _allocation_report(snapshot, peak):
+    lines = [f"Peak traced memory: {peak / 1024 / 1024:.1f} MB", ""]
+    for stat in snapshot.statistics('lineno')[:top_allocations]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines)
+
+
+def profiled(handler):
+    # Wrap a handler in cProfile and tracemalloc when profiling is requested,
+    # otherwise the handler is called directly
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        if not _is_requested(args):
+            return handler(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        profiler.enable()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            run_name = datetime.utcnow().strftime('%Y-%m-%d_%H:%M:%S')
+            profiler.create_stats()
+            _upload(f"{run_name}_{handler.__name__}.pstats", marshal.dumps(profiler.stats))
+
+            # the top functions are also printed, so the profile can be read from the logs
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(20)
+            print(summary.getvalue())
+
+            _upload(f"{run_name}_{handler.__name__}_allocations.txt", _allocation_report(snapshot, peak))
+
+    return wrapper
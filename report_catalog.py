@@ -0,0 +1,172 @@
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import sys
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Local SQLite catalog of the *_file_metadata.csv reports written by write_csv_to_s3()
+#
+# sync   : python report_catalog.py sync --bucket rtlab-petclinic-logstore-s3 --prefix csv/nfl/log/
+# query  : python report_catalog.py query --key csv/logs/file.csv --since 2024-10-01 --until 2024-11-01
+#          python report_catalog.py query --uploader alice --prefix csv/logs
+#          (--prefix matches the folder and its sub folders, with or without a trailing /)
+
+s3_client = boto3.client('s3')
+
+catalog_path = os.getenv('REPORT_CATALOG', 'report_catalog.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_key TEXT PRIMARY KEY,
+    etag TEXT NOT NULL,
+    row_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    bucket_name TEXT,
+    prefix TEXT,
+    filename TEXT,
+    object_key TEXT,
+    uploader TEXT,
+    datetime_file_landed TEXT,
+    datetime_lambda_ran TEXT,
+    error_if_any TEXT,
+    report_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_object_key ON uploads (object_key, datetime_file_landed);
+CREATE INDEX IF NOT EXISTS uploads_uploader ON uploads (uploader, datetime_file_landed);
+CREATE INDEX IF NOT EXISTS uploads_prefix ON uploads (prefix, datetime_file_landed);
+CREATE INDEX IF NOT EXISTS uploads_landed ON uploads (datetime_file_landed);
+CREATE INDEX IF NOT EXISTS uploads_report_key ON uploads (report_key);
+"""
+
+# PRAGMA user_version of a catalog whose prefixes are stored without a trailing /
+CATALOG_VERSION = 1
+
+QUERY_COLUMNS = ["bucket_name", "object_key", "uploader", "datetime_file_landed", "datetime_lambda_ran", "error_if_any", "report_key"]
+
+
+def open_catalog(path=catalog_path):
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    # prefixes are stored without a trailing /, rows of catalogs synced before are normalized once,
+    # the full table scan of the UPDATE is skipped on every later open by the user_version
+    if connection.execute("PRAGMA user_version").fetchone()[0] < CATALOG_VERSION:
+        with connection:
+            connection.execute("UPDATE uploads SET prefix = rtrim(prefix, '/') WHERE prefix LIKE '%/'")
+            connection.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+    return connection
+
+
+def parse_report(body, report_key):
+    # Reports have different columns depending on the handler which wrote them,
+    # so every row is read by its header name
+    rows = []
+    for record in csv.DictReader(io.StringIO(body)):
+        # the handlers write the folder of the key (no trailing /), prefix.py the configured prefix
+        prefix = (record.get("Prefix") or "").rstrip('/')
+        filename = record.get("Filename") or ""
+        object_key = f"{prefix}/{filename}" if prefix else filename
+        rows.append((
+            record.get("Bucket_name") or record.get("Bucket"), prefix, filename, object_key,
+            record.get("Uploader"), record.get("Datetime_file_landed"), record.get("Datetime_lambda_ran"),
+            record.get("Error_if_any"), report_key
+        ))
+    return rows
+
+
+def sync_catalog(connection, report_bucket, report_prefix):
+    # Ingest only the reports which are new or changed since the last sync
+    known = dict(connection.execute("SELECT report_key, etag FROM reports"))
+    ingested = 0
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=report_bucket, Prefix=report_prefix):
+        for obj in page.get('Contents', []):
+            report_key = obj['Key']
+            if not report_key.endswith('_file_metadata.csv') or known.get(report_key) == obj['ETag']:
+                continue
+
+            try:
+                body = s3_client.get_object(Bucket=report_bucket, Key=report_key)['Body'].read().decode('utf-8')
+            except ClientError as e:
+                print(f"Unable to read report {report_bucket}/{report_key} : error : {e}")
+                continue
+
+            rows = parse_report(body, report_key)
+            with connection:
+                connection.execute("DELETE FROM uploads WHERE report_key = ?", (report_key,))
+                connection.executemany("INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                connection.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?)", (report_key, obj['ETag'], len(rows)))
+            ingested += 1
+
+    print(f"Catalog synced, {ingested} new reports ingested from {report_bucket}/{report_prefix}")
+    return ingested
+
+
+def query_catalog(connection, object_key=None, uploader=None, prefix=None, since=None, until=None, limit=100):
+    # since/until are compared with Datetime_file_landed (YYYY-MM-DD_HH:MM:SS), so a date like 2024-10-01 also works
+    conditions = []
+    params = []
+    if object_key:
+        conditions.append("object_key = ?")
+        params.append(object_key)
+    if uploader:
+        conditions.append("uploader = ?")
+        params.append(uploader)
+    prefix = (prefix or "").rstrip('/')
+    if prefix:
+        # the folder itself or any folder below it, csv/logsX is not under csv/logs.
+        # Range conditions instead of LIKE so the prefix index is used, '0' is the character after '/'
+        conditions.append("(prefix = ? OR (prefix >= ? AND prefix < ?))")
+        params.extend([prefix, prefix + "/", prefix + "0"])
+    if since:
+        conditions.append("datetime_file_landed >= ?")
+        params.append(since)
+    if until:
+        conditions.append("datetime_file_landed < ?")
+        params.append(until)
+
+    sql = f"SELECT {', '.join(QUERY_COLUMNS)} FROM uploads"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY datetime_file_landed DESC LIMIT ?"
+    params.append(limit)
+    return connection.execute(sql, params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalog of NFL S3 file metadata reports")
+    parser.add_argument('--db', default=catalog_path, help="SQLite catalog file")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sync_parser = commands.add_parser('sync', help="ingest new reports from S3")
+    sync_parser.add_argument('--bucket', default=os.getenv('OUTPUT_BUCKET', 'rtlab-petclinic-logstore-s3'))
+    sync_parser.add_argument('--prefix', default='csv/nfl/log/')
+
+    query_parser = commands.add_parser('query', help="look up uploads")
+    query_parser.add_argument('--key', help="full object key, prefix/filename")
+    query_parser.add_argument('--uploader')
+    query_parser.add_argument('--prefix')
+    query_parser.add_argument('--since', help="YYYY-MM-DD or YYYY-MM-DD_HH:MM:SS")
+    query_parser.add_argument('--until', help="YYYY-MM-DD or YYYY-MM-DD_HH:MM:SS")
+    query_parser.add_argument('--limit', type=int, default=100)
+
+    args = parser.parse_args()
+    connection = open_catalog(args.db)
+
+    if args.command == 'sync':
+        sync_catalog(connection, args.bucket, args.prefix)
+    else:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(QUERY_COLUMNS)
+        writer.writerows(query_catalog(connection, args.key, args.uploader, args.prefix, args.since, args.until, args.limit))
+
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+
+import boto3
+from botocore.exceptions import ClientError
+
+s3_client = boto3.client('s3')
+
+# Reports are split by the hour the files landed and by bucket, in Hive style partitions:
+#
+#   <report_prefix>dt=2024-10-19/hour=14/bucket=athena-glue-1205/<run>_file_metadata.csv
+#   <report_prefix>_manifests/<run>.json        partitions and row counts written by the run
+#   <report_prefix>_table/create_table.sql      Athena table with partition projection
+#
+# Athena and Glue find the partitions from the key layout alone, no crawler or MSCK REPAIR is needed.
+# output is a bucket name, or file:///path for local reports (backfill).
+
+LANDED_FORMAT = '%Y-%m-%d_%H:%M:%S'
+# first day of the dt projection range
+projection_start = os.getenv('REPORT_PROJECTION_START', '2024-01-01')
+
+
+def partition_values(bucket_name, landed_time):
+    return landed_time.strftime('%Y-%m-%d'), landed_time.strftime('%H'), bucket_name
+
+
+def partition_path(report_prefix, bucket_name, landed_time):
+    dt, hour, bucket = partition_values(bucket_name, landed_time)
+    return f"{report_prefix}dt={dt}/hour={hour}/bucket={bucket}/"
+
+
+def report_key(report_prefix, run_label, bucket_name, landed_time):
+    # Key of the report file holding the row of a file which landed at landed_time
+    return f"{partition_path(report_prefix, bucket_name, landed_time)}{run_label}_file_metadata.csv"
+
+
+def _put(output, key, body, metadata=None):
+    if output.startswith('file://'):
+        path = os.path.join(output[len('file://'):], *key.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', newline='') as report_file:
+            report_file.write(body)
+        return path
+
+    s3_client.put_object(Bucket=output, Key=key, Body=body, Metadata=metadata or {})
+    return f"{output}/{key}"
+
+
+def table_ddl(table_name, output, report_prefix, header, bucket_names):
+    # CREATE TABLE with partition projection over dt (date), hour (00-23) and bucket (monitored buckets)
+    location = f"{output}/{report_prefix}" if output.startswith('file://') else f"s3://{output}/{report_prefix}"
+    columns = ",\n".join(f"  `{name.lower()}` string" for name in header)
+    return f"""CREATE EXTERNAL TABLE IF NOT EXISTS {table_name} (
+{columns}
+)
+PARTITIONED BY (`dt` string, `hour` string, `bucket` string)
+ROW FORMAT SERDE 'org.apache.hadoop.hive.serde2.OpenCSVSerde'
+LOCATION '{location}'
+TBLPROPERTIES (
+  'skip.header.line.count' = '1',
+  'projection.enabled' = 'true',
+  'projection.dt.type' = 'date',
+  'projection.dt.format' = 'yyyy-MM-dd',
+  'projection.dt.range' = '{projection_start},NOW',
+  'projection.hour.type' = 'integer',
+  'projection.hour.range' = '0,23',
+  'projection.hour.digits' = '2',
+  'projection.bucket.type' = 'enum',
+  'projection.bucket.values' = '{",".join(sorted(set(bucket_names)))}',
+  'storage.location.template' = '{location}dt=${{dt}}/hour=${{hour}}/bucket=${{bucket}}/'
+)
+"""
+
+
+def write_report(output, report_prefix, run_label, header, rows, bucket_names, table_name='nfl_file_metadata', metadata=None, fallback_time=None):
+    # Write rows to their partitions, then the run manifest and the table metadata.
+    # Rows are partitioned by their Bucket_name and Datetime_file_landed columns, rows without a
+    # landed time (errors) go to the partition of fallback_time.
+    bucket_column = header.index("Bucket_name")
+    landed_column = header.index("Datetime_file_landed")
+
+    partitions = {}
+    for row in rows:
+        try:
+            landed_time = datetime.strptime(row[landed_column], LANDED_FORMAT)
+        except (ValueError, IndexError):
+            landed_time = fallback_time or datetime.utcnow()
+        key = report_key(report_prefix, run_label, row[bucket_column], landed_time)
+        partitions.setdefault(key, (partition_values(row[bucket_column], landed_time), []))[1].append(row)
+
+    manifest = {'run': run_label, 'row_count': len(rows), 'partitions': []}
+    try:
+        for key, ((dt, hour, bucket), partition_rows) in sorted(partitions.items()):
+            csv_buffer = io.StringIO()
+            writer = csv.writer(csv_buffer)
+            writer.writerow(header)
+            writer.writerows(partition_rows)
+            location = _put(output, key, csv_buffer.getvalue(), metadata)
+            manifest['partitions'].append({'dt': dt, 'hour': hour, 'bucket': bucket, 'key': key, 'row_count': len(partition_rows)})
+            print(f"CSV file uploaded to {location}")
+
+        _put(output, f"{report_prefix}_manifests/{run_label}.json", json.dumps(manifest, indent=2), metadata)
+        _put(output, f"{report_prefix}_table/create_table.sql", table_ddl(table_name, output, report_prefix, header, bucket_names))
+
+    except (ClientError, OSError) as e:
+        print(f"Error uploading CSV to {output}/{report_prefix}: {e}")
+
+    return manifest
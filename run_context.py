@@ -0,0 +1,22 @@
+from array import array
+from datetime import datetime, timezone
+
+# State of a single invocation. Lambda reuses a warm container for the next invocations, so anything
+# a run produces (report rows, notification data, its start time) is created by every lambda_handler call
+# instead of at import. Only clients and caches are kept at module level.
+
+
+def new_run(csv_header, output_csv_key_format=None):
+    # output_csv_key_format may use {lambda_time_ran}, for example 'csv/nfl/logs/{lambda_time_ran}_file_metadata.csv'
+    current_time_utc = datetime.utcnow().replace(tzinfo=timezone.utc)
+    lambda_time_ran = current_time_utc.strftime('%Y-%m-%d_%H:%M:%S')
+    return {
+        'current_time_utc': current_time_utc,
+        'lambda_time_ran': lambda_time_ran,
+        'output_csv_key': output_csv_key_format.format(lambda_time_ran=lambda_time_ran) if output_csv_key_format else None,
+        'csv_data': [list(csv_header)],
+        'file_metadatas': [],
+        # reported objects as columns (bucket/key, LastModified epoch, size, uploader),
+        # for the per prefix, uploader and hour totals, see listing_columns
+        'reported_objects': {'key': [], 'epoch': array('q'), 'size': array('q'), 'uploader': []}
+    }
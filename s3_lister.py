@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+s3_client = boto3.client('s3')
+
+# How many levels of sub-prefixes are discovered before the leaves are listed, and how many listings run at once
+walk_depth = int(os.getenv('LIST_WALK_DEPTH', '2'))
+walk_workers = int(os.getenv('LIST_WALK_WORKERS', '8'))
+# How many monitored bucket/prefix locations are listed at once
+location_workers = int(os.getenv('LIST_LOCATION_WORKERS', '8'))
+
+
+def iter_objects(bucket_name, prefix='', client=None):
+    # Yield every object under prefix, following the continuation token page by page
+    client = client or s3_client
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        yield from page.get('Contents', [])
+
+
+def list_level(bucket_name, prefix='', client=None):
+    # One level of the keyspace below prefix: (sub-prefixes, objects directly under prefix)
+    client = client or s3_client
+    sub_prefixes = []
+    objects = []
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter='/'):
+        sub_prefixes.extend(common_prefix['Prefix'] for common_prefix in page.get('CommonPrefixes', []))
+        objects.extend(page.get('Contents', []))
+    return sub_prefixes, objects
+
+
+def list_buckets(client=None):
+    client = client or s3_client
+    return [bucket['Name'] for bucket in client.list_buckets().get('Buckets', [])]
+
+
+def walk_prefix(bucket_name, prefix='', depth=None, folder_depth=None, workers=None, client=None):
+    # List every object under prefix by first discovering sub-prefixes with Delimiter='/' up to
+    # 'depth' levels, then listing the leaf prefixes concurrently. With 'folder_depth' the walk never
+    # goes deeper than that many folders below prefix (folder level monitoring, 0 = only the objects
+    # directly under prefix). Objects are returned sorted by key.
+    depth = walk_depth if depth is None else depth
+    workers = workers or walk_workers
+    if folder_depth is not None:
+        depth = folder_depth + 1
+
+    objects = []
+    level = [prefix]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(depth):
+            next_level = []
+            for sub_prefixes, level_objects in executor.map(lambda level_prefix: list_level(bucket_name, level_prefix, client), level):
+                next_level.extend(sub_prefixes)
+                objects.extend(level_objects)
+            level = next_level
+            if not level:
+                break
+
+        # leaves are listed completely, unless the walk is limited to folder level
+        if level and folder_depth is None:
+            for leaf_objects in executor.map(lambda leaf_prefix: list(iter_objects(bucket_name, leaf_prefix, client)), level):
+                objects.extend(leaf_objects)
+
+    objects.sort(key=lambda obj: obj['Key'])
+    return objects
+
+
+def list_locations(locations, list_location, workers=None):
+    # Run list_location(bucket, prefix) for every (bucket, prefix) in parallel. Results are returned
+    # in the order of locations, a ClientError of a listing is returned in place of its result
+    results = []
+    if not locations:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(workers or location_workers, len(locations))) as executor:
+        futures = [(location, executor.submit(list_location, *location)) for location in locations]
+        for location, future in futures:
+            try:
+                results.append((location, future.result()))
+            except ClientError as e:
+                results.append((location, e))
+
+    return results
@@ -0,0 +1,90 @@
+import argparse
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+import s3_lister
+
+# Search object keys of every bucket (or the given buckets) for a pattern
+#
+# python s3_search.py Hershey
+# python s3_search.py 'hershey.*\.csv$' --buckets bucket01 bucket02 --workers 32
+
+print_lock = threading.Lock()
+
+
+def emit(bucket_name, keys):
+    with print_lock:
+        for key in keys:
+            print(f"s3://{bucket_name}/{key}")
+        sys.stdout.flush()
+
+
+def discover_shards(bucket_name):
+    # Split the bucket by its top level prefixes, keys at the top level are matched right away
+    try:
+        sub_prefixes, objects = s3_lister.list_level(bucket_name)
+    except ClientError as e:
+        print(f"Unable to list bucket {bucket_name} : error : {e}", file=sys.stderr)
+        return bucket_name, [], []
+    return bucket_name, sub_prefixes, objects
+
+
+def search_shard(bucket_name, prefix, pattern):
+    scanned = 0
+    matches = []
+    try:
+        for obj in s3_lister.iter_objects(bucket_name, prefix):
+            scanned += 1
+            if pattern.search(obj['Key']):
+                matches.append(obj['Key'])
+                # stream matches out in small groups instead of at the end of the shard
+                if len(matches) >= 100:
+                    emit(bucket_name, matches)
+                    matches = []
+    except ClientError as e:
+        print(f"Unable to list {bucket_name}/{prefix} : error : {e}", file=sys.stderr)
+    emit(bucket_name, matches)
+    return scanned
+
+
+def search(pattern, bucket_names, workers):
+    started = time.time()
+    scanned = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        shards = []
+        for bucket_name, sub_prefixes, objects in executor.map(discover_shards, bucket_names):
+            scanned += len(objects)
+            emit(bucket_name, [obj['Key'] for obj in objects if pattern.search(obj['Key'])])
+            shards.extend((bucket_name, sub_prefix) for sub_prefix in sub_prefixes)
+
+        futures = [executor.submit(search_shard, bucket_name, prefix, pattern) for bucket_name, prefix in shards]
+        scanned += sum(future.result() for future in futures)
+
+    elapsed = time.time() - started
+    print(
+        f"Scanned {scanned} keys in {len(bucket_names)} buckets ({len(shards)} prefixes) in {elapsed:.1f}s, "
+        f"{scanned / elapsed if elapsed else 0:.0f} keys/s",
+        file=sys.stderr
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search object keys across S3 buckets")
+    parser.add_argument('pattern', help="regular expression, matched case-insensitively")
+    parser.add_argument('--buckets', nargs='*', help="buckets to search, default is every bucket")
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+
+    pattern = re.compile(args.pattern, re.IGNORECASE)
+    bucket_names = args.buckets or s3_lister.list_buckets()
+    search(pattern, bucket_names, args.workers)
+
+
+if __name__ == '__main__':
+    main()
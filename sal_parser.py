@@ -0,0 +1,150 @@
+import calendar
+import gzip
+import re
+from urllib.parse import unquote
+
+# NumPy is optional, when it is installed columns are backed by numpy arrays and
+# filters are vectorized, otherwise plain python lists are used
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Server Access Log record layout (leading fields, trailing fields are ignored)
+# bucket_owner bucket [time] remote_ip requester request_id operation key "request_uri" http_status error_code bytes_sent object_size total_time turnaround_time ...
+SAL_COLUMNS = [
+    "bucket_owner", "bucket", "time", "remote_ip", "requester", "request_id", "operation", "key",
+    "request_uri", "http_status", "error_code", "bytes_sent", "object_size", "total_time", "turnaround_time"
+]
+NUMERIC_COLUMNS = ["http_status", "bytes_sent", "object_size", "total_time", "turnaround_time"]
+# columns of the upload records kept per log file, see upload_columns
+UPLOAD_COLUMNS = ["bucket", "key", "requester", "time"]
+
+sal_line_pattern = re.compile(
+    r'^(\S+) (\S+) \[([^\]]+)\] (\S+) (\S+) (\S+) (\S+) (\S+) "([^"]*)" (\S+) (\S+) (\S+) (\S+) (\S+) (\S+)',
+    re.MULTILINE
+)
+
+MONTHS = {name: index for index, name in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], start=1)}
+
+
+def parse_sal_time(value, time_cache=None):
+    # value format: 06/Feb/2019:00:00:38 +0000
+    # many log lines share the same second, so parse_sal_logs memoizes the timestamps of a batch in time_cache
+    epoch = time_cache.get(value) if time_cache is not None else None
+    if epoch is None:
+        epoch = calendar.timegm((
+            int(value[7:11]), MONTHS[value[3:6]], int(value[0:2]),
+            int(value[12:14]), int(value[15:17]), int(value[18:20])
+        ))
+        offset = value[21:26]
+        if offset and offset != "+0000":
+            sign = -1 if offset[0] == '-' else 1
+            epoch -= sign * (int(offset[1:3]) * 3600 + int(offset[3:5]) * 60)
+        if time_cache is not None:
+            time_cache[value] = epoch
+    return epoch
+
+
+def _to_int(value):
+    return 0 if value == '-' else int(value)
+
+
+def column_length(columns):
+    return len(columns["key"])
+
+
+def parse_sal_logs(log_bodies):
+    # Parse a batch of server access log objects (str, bytes or memory mapped files) into columns
+    rows = []
+    for body in log_bodies:
+        if not isinstance(body, str):
+            # bytes, or a memory mapped local file (see log_source), possibly gzipped
+            body = body[:]
+            if body[:2] == b'\x1f\x8b':
+                body = gzip.decompress(body)
+            body = body.decode('utf-8', errors='replace')
+        rows.extend(sal_line_pattern.findall(body))
+
+    # transpose row tuples into one sequence per column
+    transposed = list(zip(*rows)) if rows else [() for _ in SAL_COLUMNS]
+    columns = dict(zip(SAL_COLUMNS, transposed))
+
+    # keys are URL encoded in access logs
+    columns["key"] = [unquote(key) for key in columns["key"]]
+    # the memo only lives for this batch, a module level one grew with every second of the logs in a warm container
+    time_cache = {}
+    columns["time"] = [parse_sal_time(value, time_cache) for value in columns["time"]]
+    for name in NUMERIC_COLUMNS:
+        columns[name] = [_to_int(value) for value in columns[name]]
+
+    if np is not None:
+        for name in SAL_COLUMNS:
+            if name == "time" or name in NUMERIC_COLUMNS:
+                columns[name] = np.asarray(columns[name], dtype=np.int64)
+            else:
+                columns[name] = np.asarray(columns[name], dtype=object)
+    else:
+        for name in SAL_COLUMNS:
+            columns[name] = list(columns[name])
+
+    return columns
+
+
+def take_rows(columns, mask):
+    # Keep only the rows where mask is true
+    if np is not None:
+        mask = np.asarray(mask, dtype=bool)
+        return {name: values[mask] for name, values in columns.items()}
+    return {name: [value for value, keep in zip(values, mask) if keep] for name, values in columns.items()}
+
+
+def filter_uploads(columns, bucket_names, operation="REST.PUT.OBJECT"):
+    # Keep successful upload records for the monitored buckets only (every bucket when bucket_names is None).
+    # With operation None the columns hold upload records already (see upload_columns), only the buckets are filtered
+    bucket_names = set(bucket_names) if bucket_names is not None else None
+    if np is not None:
+        mask = np.ones(column_length(columns), dtype=bool)
+        if operation is not None:
+            mask &= (columns["operation"] == operation) & (columns["http_status"] < 300)
+        if bucket_names is not None:
+            mask &= np.isin(columns["bucket"], list(bucket_names))
+    else:
+        mask = [bucket_names is None or bucket in bucket_names for bucket in columns["bucket"]]
+        if operation is not None:
+            mask = [
+                keep and op == operation and status < 300
+                for keep, op, status in zip(mask, columns["operation"], columns["http_status"])
+            ]
+    return take_rows(columns, mask)
+
+
+def upload_columns(columns):
+    # Only the columns used by build_uploader_index, what log_cache keeps of every parsed log file
+    return {name: columns[name] for name in UPLOAD_COLUMNS}
+
+
+def columns_size(columns):
+    # Estimated size of upload columns for log_cache, about 100 bytes of overhead per record
+    return 64 + sum(100 + len(bucket) + len(key) + len(requester) for bucket, key, requester in zip(columns["bucket"], columns["key"], columns["requester"]))
+
+
+def concat_columns(column_batches):
+    # Join the upload columns of several log files into one set of columns
+    if np is not None:
+        return {
+            name: np.concatenate([batch[name] for batch in column_batches]) if column_batches else np.asarray([], dtype=np.int64 if name == "time" else object)
+            for name in UPLOAD_COLUMNS
+        }
+    return {name: [value for batch in column_batches for value in batch[name]] for name in UPLOAD_COLUMNS}
+
+
+def build_uploader_index(columns):
+    # Map (bucket, key) to the requester of the latest upload record
+    latest = {}
+    for bucket, key, requester, epoch in zip(columns["bucket"], columns["key"], columns["requester"], columns["time"]):
+        current = latest.get((bucket, key))
+        if current is None or epoch >= current[0]:
+            latest[(bucket, key)] = (int(epoch), requester)
+    return {location: requester for location, (epoch, requester) in latest.items()}
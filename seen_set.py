@@ -0,0 +1,54 @@
+import hashlib
+import os
+import time
+
+import state_store
+
+# Where the set of already reported files is kept: s3://bucket/key, or a local path as a stand-in
+seen_set_location = os.getenv('SEEN_SET_LOCATION', '/tmp/nfl_seen_set.json.gz')
+# Entries are forgotten after this many hours, it must be longer than the detection window
+seen_ttl_hours = int(os.getenv('SEEN_TTL_HOURS', '72'))
+
+# 8 byte digest of (bucket, key, etag) -> epoch seconds when it was first reported
+seen = {}
+_loaded = False
+
+
+def _digest(*fields):
+    return hashlib.blake2b('\0'.join(fields).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def load_seen_set():
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+
+    state = state_store.load_state(seen_set_location, "seen set")
+    if state is None:
+        return
+
+    expires_before = time.time() - seen_ttl_hours * 3600
+    seen.update((digest, first_seen) for digest, first_seen in state.items() if first_seen >= expires_before)
+
+
+def save_seen_set():
+    if not _loaded:
+        return
+
+    # expired entries are dropped from memory as well, a warm container keeps the set between invocations
+    expires_before = time.time() - seen_ttl_hours * 3600
+    for digest in [digest for digest, first_seen in seen.items() if first_seen < expires_before]:
+        del seen[digest]
+    state_store.save_state(seen_set_location, "seen set", seen)
+
+
+def is_seen(bucket_name, file_key, version):
+    # version is the ETag of the file (or the upload time when the ETag is not known)
+    load_seen_set()
+    return _digest(bucket_name, file_key, version) in seen
+
+
+def mark_seen(bucket_name, file_key, version):
+    load_seen_set()
+    seen.setdefault(_digest(bucket_name, file_key, version), int(time.time()))
@@ -0,0 +1,183 @@
+import calendar
+import csv
+import heapq
+import io
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import boto3
+
+import state_store
+
+s3_client = boto3.client('s3')
+
+# Expected arrivals: CSV (local path or s3://bucket/key) with Bucket, Prefix, Schedule and Grace_minutes columns,
+# Schedule is a cron expression in UTC (minute hour day_of_month month day_of_week), for example
+#   athena-glue-1205,csv/logs/,0 6 * * 1-5,45    a file every weekday by 06:45
+sla_schedules_file = os.getenv('SLA_SCHEDULES_FILE')
+# Pending deadlines and recent arrivals: s3://bucket/key, or a local path as a stand-in
+sla_state_location = os.getenv('SLA_STATE_LOCATION', '/tmp/nfl_sla_state.json.gz')
+
+CRON_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+# schedule id -> {'bucket', 'prefix', 'schedule', 'grace_minutes', 'fields'}
+schedules = {}
+# min-heap of [deadline, schedule id, window start, expected time] in epoch seconds,
+# every schedule has exactly one pending deadline
+deadlines = []
+# schedule id -> epochs of the files which landed since the window start of its pending deadline
+arrivals = {}
+_loaded = False
+
+
+def parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        value_range, _, step = part.partition('/')
+        if value_range == '*':
+            start, end = low, high
+        elif '-' in value_range:
+            start, end = (int(value) for value in value_range.split('-'))
+        else:
+            start = end = int(value_range)
+        # day of week 7 is Sunday like 0
+        if start < low or end > (7 if high == 6 else high) or start > end:
+            raise ValueError(f"{part} is out of range {low}-{high}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return sorted({value % 7 if high == 6 else value for value in values})
+
+
+def parse_cron(expression):
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError(f"{expression} is not a 5 field cron expression")
+    parsed = [parse_cron_field(field, low, high) for field, (low, high) in zip(fields, CRON_RANGES)]
+    # like cron, when both day fields are restricted a day matching either of them fires
+    return parsed + [fields[2] != '*', fields[4] != '*']
+
+
+def next_fire(fields, after):
+    # First time strictly after 'after' (epoch seconds) matching the schedule, within a year
+    minutes, hours, days, months, weekdays, days_restricted, weekdays_restricted = fields
+    start = datetime.fromtimestamp(after, tz=timezone.utc).replace(second=0) + timedelta(minutes=1)
+    day = start.replace(hour=0, minute=0)
+    for _ in range(366):
+        # cron counts Sunday as 0, python as 6
+        day_match, weekday_match = day.day in days, (day.weekday() + 1) % 7 in weekdays
+        if days_restricted and weekdays_restricted:
+            day_matches = day_match or weekday_match
+        else:
+            day_matches = day_match and weekday_match
+        if day.month in months and day_matches:
+            for hour in hours:
+                for minute in minutes:
+                    candidate = day.replace(hour=hour, minute=minute)
+                    if candidate >= start:
+                        return calendar.timegm(candidate.utctimetuple())
+        day += timedelta(days=1)
+    return None
+
+
+def read_schedules_file(path):
+    if path.startswith('s3://'):
+        sheet_bucket, sheet_key = path[5:].split('/', 1)
+        body = s3_client.get_object(Bucket=sheet_bucket, Key=sheet_key)['Body'].read().decode('utf-8-sig')
+    else:
+        with open(path, encoding='utf-8-sig') as sheet_file:
+            body = sheet_file.read()
+
+    entries = {}
+    for row in csv.DictReader(io.StringIO(body)):
+        row = {name.strip().lower(): (value or '').strip() for name, value in row.items() if name}
+        if not row.get('bucket') or not row.get('schedule'):
+            continue
+        try:
+            fields = parse_cron(row['schedule'])
+        except ValueError as e:
+            print(f"Skipping SLA schedule of {row['bucket']}/{row.get('prefix', '')} : error : {e}")
+            continue
+        schedule_id = f"{row['bucket']}:{row.get('prefix', '')}:{row['schedule']}"
+        entries[schedule_id] = {
+            'bucket': row['bucket'],
+            'prefix': row.get('prefix', ''),
+            'schedule': row['schedule'],
+            'grace_minutes': int(row.get('grace_minutes') or 0),
+            'fields': fields
+        }
+    return entries
+
+
+def _push_next(schedule_id, window_start, after):
+    schedule = schedules[schedule_id]
+    expected = next_fire(schedule['fields'], after)
+    if expected is None:
+        # for example 0 0 30 2 *, the schedule has no pending deadline until the SLA state is loaded again
+        print(f"Warning: SLA schedule '{schedule['schedule']}' of {schedule['bucket']}/{schedule['prefix']} does not fire within a year, it is not checked")
+        return
+    heapq.heappush(deadlines, [expected + schedule['grace_minutes'] * 60, schedule_id, window_start, expected])
+
+
+def load_sla_state():
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    if not sla_schedules_file:
+        return
+
+    schedules.update(read_schedules_file(sla_schedules_file))
+    state = state_store.load_state(sla_state_location, "SLA state") or {'deadlines': [], 'arrivals': {}}
+
+    # deadlines of schedules which were removed or changed are dropped, new schedules start now
+    deadlines.extend(entry for entry in state['deadlines'] if entry[1] in schedules)
+    heapq.heapify(deadlines)
+    arrivals.update((schedule_id, epochs) for schedule_id, epochs in state['arrivals'].items() if schedule_id in schedules)
+    pending_ids = {entry[1] for entry in deadlines}
+    now = int(time.time())
+    for schedule_id in schedules:
+        if schedule_id not in pending_ids:
+            _push_next(schedule_id, now, now)
+
+
+def save_sla_state():
+    if not _loaded or not sla_schedules_file:
+        return
+
+    state_store.save_state(sla_state_location, "SLA state", {'deadlines': deadlines, 'arrivals': arrivals})
+
+
+def record_arrival(bucket_name, file_key, landed_time):
+    # A file landed under a scheduled prefix, it counts for the pending deadline of that schedule
+    load_sla_state()
+    epoch = int(landed_time.timestamp())
+    for schedule_id, schedule in schedules.items():
+        if schedule['bucket'] == bucket_name and file_key.startswith(schedule['prefix']):
+            schedule_arrivals = arrivals.setdefault(schedule_id, [])
+            if epoch not in schedule_arrivals:
+                schedule_arrivals.append(epoch)
+
+
+def check_deadlines(now):
+    # Evaluate only the deadlines which passed, the others stay in the heap untouched.
+    # Returns an alert message for every expected arrival which did not happen in time.
+    load_sla_state()
+    now = int(now.timestamp())
+    alerts = []
+    while deadlines and deadlines[0][0] <= now:
+        deadline, schedule_id, window_start, expected = heapq.heappop(deadlines)
+        schedule = schedules[schedule_id]
+        schedule_arrivals = arrivals.get(schedule_id, [])
+
+        if not any(window_start <= epoch <= deadline for epoch in schedule_arrivals):
+            expected_time = datetime.fromtimestamp(expected, tz=timezone.utc).strftime('%Y-%m-%d_%H:%M')
+            alerts.append(
+                f"No file landed in bucket: {schedule['bucket']}/{schedule['prefix']} for the expected arrival of {expected_time} UTC "
+                f"(schedule '{schedule['schedule']}', {schedule['grace_minutes']} minutes grace)."
+            )
+
+        # arrivals after this deadline count for the next expected arrival
+        arrivals[schedule_id] = [epoch for epoch in schedule_arrivals if epoch > deadline]
+        _push_next(schedule_id, deadline, expected)
+
+    return alerts
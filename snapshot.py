@@ -0,0 +1,91 @@
+import csv
+import gzip
+import io
+import os
+from datetime import timedelta
+
+import boto3
+from botocore.exceptions import ClientError
+
+s3_client = boto3.client('s3')
+
+# Snapshots of every monitored bucket:prefix are stored as sorted, gzipped TSV (key, etag, size)
+snapshot_bucket = os.getenv('SNAPSHOT_BUCKET', os.getenv('OUTPUT_BUCKET', 'rtlab-petclinic-logstore-s3'))
+snapshot_prefix = os.getenv('SNAPSHOT_PREFIX', 'state/snapshots/')
+
+
+def snapshot_key(bucket_name, prefix):
+    return f"{snapshot_prefix}{bucket_name}/{prefix}_snapshot.tsv.gz"
+
+
+def load_snapshot(bucket_name, prefix):
+    # Stream (key, etag, size) rows of the previous snapshot, None if there is no snapshot yet
+    try:
+        body = s3_client.get_object(Bucket=snapshot_bucket, Key=snapshot_key(bucket_name, prefix))['Body']
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+    def rows():
+        with gzip.GzipFile(fileobj=body) as snapshot_file:
+            for key, etag, size in csv.reader(io.TextIOWrapper(snapshot_file, encoding='utf-8'), delimiter='\t'):
+                yield key, etag, int(size)
+
+    return rows()
+
+
+def save_snapshot(bucket_name, prefix, entries):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as snapshot_file:
+        with io.TextIOWrapper(snapshot_file, encoding='utf-8', newline='') as text_file:
+            csv.writer(text_file, delimiter='\t').writerows(entries)
+    s3_client.put_object(Bucket=snapshot_bucket, Key=snapshot_key(bucket_name, prefix), Body=buffer.getvalue())
+
+
+def list_objects(bucket_name, prefix):
+    # S3 returns keys in ascending UTF-8 order, the same order python sorts strings in
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        yield from page.get('Contents', [])
+
+
+def diff_listing(listing, snapshot_rows):
+    # Merge the sorted listing with the sorted snapshot in a single pass,
+    # yielding (object, changed) where changed is true for new or modified objects
+    previous = iter(snapshot_rows)
+    current = next(previous, None)
+    for obj in listing:
+        key = obj['Key']
+        # keys only in the snapshot were deleted since the last run
+        while current is not None and current[0] < key:
+            current = next(previous, None)
+
+        if current is not None and current[0] == key:
+            changed = current[1] != obj['ETag'] or current[2] != obj['Size']
+            current = next(previous, None)
+        else:
+            changed = True
+        yield obj, changed
+
+
+def find_new_objects(bucket_name, prefix, current_time_utc, max_time_interval):
+    # Return objects which are new or changed since the last snapshot and store the new snapshot.
+    # The first run has no snapshot, so it falls back to the 'max_time_interval' window.
+    snapshot_rows = load_snapshot(bucket_name, prefix)
+    new_objects = []
+    entries = []
+
+    if snapshot_rows is None:
+        print(f"No snapshot found for {bucket_name}/{prefix}, using the last {max_time_interval} hours")
+        for obj in list_objects(bucket_name, prefix):
+            entries.append((obj['Key'], obj['ETag'], obj['Size']))
+            if current_time_utc - obj['LastModified'] <= timedelta(hours=max_time_interval):
+                new_objects.append(obj)
+    else:
+        for obj, changed in diff_listing(list_objects(bucket_name, prefix), snapshot_rows):
+            entries.append((obj['Key'], obj['ETag'], obj['Size']))
+            if changed:
+                new_objects.append(obj)
+
+    return new_objects, entries
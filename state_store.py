@@ -0,0 +1,38 @@
+import gzip
+import json
+
+import boto3
+from botocore.exceptions import ClientError
+
+s3_client = boto3.client('s3')
+
+# State kept between invocations (seen set, pending queue, SLA state) is stored as gzipped JSON
+# at s3://bucket/key, or at a local path as a stand-in
+
+
+def load_state(location, name):
+    # Decoded state stored at location, None when there is none yet
+    try:
+        if location.startswith('s3://'):
+            state_bucket, state_key = location[5:].split('/', 1)
+            body = s3_client.get_object(Bucket=state_bucket, Key=state_key)['Body'].read()
+        else:
+            with open(location, 'rb') as state_file:
+                body = state_file.read()
+    except (ClientError, FileNotFoundError) as e:
+        print(f"No {name} loaded from {location} : error : {e}")
+        return None
+    return json.loads(gzip.decompress(body))
+
+
+def save_state(location, name, state):
+    body = gzip.compress(json.dumps(state).encode('utf-8'))
+    try:
+        if location.startswith('s3://'):
+            state_bucket, state_key = location[5:].split('/', 1)
+            s3_client.put_object(Bucket=state_bucket, Key=state_key, Body=body)
+        else:
+            with open(location, 'wb') as state_file:
+                state_file.write(body)
+    except (ClientError, OSError) as e:
+        print(f"Error saving {name} to {location}: {e}")
@@ -0,0 +1,109 @@
+import contextlib
+import gc
+import importlib.util
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pandas")
+
+from botocore.stub import Stubber
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INVOCATIONS = 1000
+WARM_UP = 100
+FILES_PER_INVOCATION = 5
+# allowed growth of the traced memory between the end of the warm up and the last invocation,
+# a state growing by one small entry per file adds several hundred KB
+MAX_GROWTH_BYTES = 192 * 1024
+
+NFL_BUCKET = 'nfl-bucket'
+NFL_PREFIX = 'csv/logs/'
+UPLOADER_ARN = 'arn:aws:iam::111122223333:user/alice'
+
+
+@pytest.fixture
+def sal_email(tmp_path, monkeypatch):
+    # SAL/email.py with its log bucket, reports and state in tmp_path, only S3 listings and SNS go through Stubber
+    log_dir = tmp_path / 'logs'
+    (log_dir / 'Awslogs' / 's3').mkdir(parents=True)
+    for name, value in {
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'BUCKET_NAMES': f'{NFL_BUCKET}:{NFL_PREFIX}',
+        'SAL_LOG_PARTITIONS': f'111122223333:us-east-1:file://{log_dir}',
+        'OUTPUT_BUCKET': f'file://{tmp_path / "reports"}',
+        'SEEN_SET_LOCATION': str(tmp_path / 'seen_set.json.gz'),
+        'PENDING_QUEUE_LOCATION': str(tmp_path / 'pending_uploads.json.gz'),
+        'LOG_DISK_CACHE_DIR': str(tmp_path / 'log_cache'),
+    }.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv('SLA_SCHEDULES_FILE', raising=False)
+    monkeypatch.delenv('MONITORED_PREFIXES_FILE', raising=False)
+    monkeypatch.delenv('PROFILE', raising=False)
+    monkeypatch.syspath_prepend(REPO_ROOT)
+
+    # SAL/email.py would shadow the standard library email package, it is loaded under another name
+    spec = importlib.util.spec_from_file_location('sal_email', os.path.join(REPO_ROOT, 'SAL', 'email.py'))
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, 'sal_email', module)
+    spec.loader.exec_module(module)
+    return module, log_dir / 'Awslogs' / 's3' / 'access.log'
+
+
+def test_memory_is_stable_over_warm_invocations(sal_email, tmp_path):
+    module, log_path = sal_email
+    import log_partitions
+    import seen_set
+
+    # every invocation stands for a run after the TTL of the previous ones, so the seen set has to shrink again
+    seen_set.seen_ttl_hours = 0
+
+    s3_stubber = Stubber(module.s3_client)
+    sns_stubber = Stubber(module.sns_client)
+    location_stubber = Stubber(log_partitions.s3_client)
+    location_stubber.add_response('get_bucket_location', {}, {'Bucket': NFL_BUCKET})
+
+    start = datetime.now(timezone.utc)
+    memory = {}
+    with s3_stubber, sns_stubber, location_stubber, open(os.devnull, 'w') as devnull:
+        tracemalloc.start()
+        try:
+            for invocation in range(INVOCATIONS):
+                # new files every invocation, each uploaded at a new second of the access log
+                contents = []
+                log_lines = []
+                for file_number in range(FILES_PER_INVOCATION):
+                    upload_number = invocation * FILES_PER_INVOCATION + file_number
+                    file_key = f'{NFL_PREFIX}file_{upload_number}.csv'
+                    upload_time = start - timedelta(hours=2) + timedelta(seconds=upload_number)
+                    contents.append({'Key': file_key, 'LastModified': upload_time, 'ETag': f'"{upload_number}"', 'Size': 10})
+                    log_lines.append(
+                        f'owner {NFL_BUCKET} [{upload_time.strftime("%d/%b/%Y:%H:%M:%S +0000")}] 10.0.0.1 {UPLOADER_ARN} '
+                        f'REQ{upload_number} REST.PUT.OBJECT {file_key} "PUT /{file_key} HTTP/1.1" 200 - - 10 12 8 -\n'
+                    )
+                log_path.write_text(''.join(log_lines))
+                s3_stubber.add_response('list_objects_v2', {'Contents': contents}, {'Bucket': NFL_BUCKET, 'Prefix': NFL_PREFIX})
+                sns_stubber.add_response('publish', {'MessageId': str(invocation)})
+
+                with contextlib.redirect_stdout(devnull):
+                    module.lambda_handler({}, None)
+
+                if invocation + 1 in (WARM_UP, INVOCATIONS):
+                    # cyclic garbage waits for a full collection, only live memory is compared
+                    gc.collect()
+                    memory[invocation + 1] = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+        s3_stubber.assert_no_pending_responses()
+        sns_stubber.assert_no_pending_responses()
+
+    reports = list((tmp_path / 'reports').glob('csv/nfl/log/dt=*/hour=*/bucket=*/*_file_metadata.csv'))
+    assert reports
+    assert memory[INVOCATIONS] - memory[WARM_UP] < MAX_GROWTH_BYTES